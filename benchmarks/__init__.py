@@ -0,0 +1,7 @@
+from .main import (
+    make_corpus,
+    run,
+    compare,
+    save_baseline,
+    main,
+)
@@ -0,0 +1,107 @@
+"""Import-time regression check for the top-level packages.
+
+Every package is imported in a fresh interpreter with `python -X importtime`. The check fails when a
+package pulls in one of the heavy dependencies that should only load on first use, or when its
+cumulative import time exceeds the budget.
+
+    python -m benchmarks.importtime --budget-ms 150
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGES = (
+    'download',
+    'pipeline',
+    'service',
+    'subtitle',
+    'transcribe',
+    'translate',
+    'utils.algorithm',
+    'utils.artifacts',
+    'utils.aws',
+    'utils.aws_async',
+    'utils.fakes',
+    'utils.metrics',
+    'utils.minhash',
+    'utils.regions',
+    'utils.srtUtils',
+)
+
+# Dependencies that take tens to hundreds of milliseconds and must be imported lazily.
+LAZY_DEPENDENCIES = (
+    'aiobotocore',
+    'aiohttp',
+    'boto3',
+    'botocore',
+    'ffmpeg',
+    'numpy',
+    'pytube',
+    'requests',
+    'strsimpy',
+)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_profile(module):
+    """Import module in a fresh interpreter and return {imported module: cumulative microseconds}."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    profile = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = int(cumulative)
+
+    return profile
+
+
+def check(packages=PACKAGES, budget_ms=None, repeat=3):
+    """Return a list of problems, empty when every package imports within the rules."""
+    problems = []
+
+    for package in packages:
+        # The best of a few runs, the first one may be slowed down by a cold disk cache.
+        profiles = [import_profile(package) for _ in range(repeat)]
+        milliseconds = min(profile[package] for profile in profiles) / 1000
+
+        eager = sorted({
+            name.split('.')[0] for name in profiles[0]
+            if name.split('.')[0] in LAZY_DEPENDENCIES
+        })
+
+        print(f'{package:<20} {milliseconds:8.1f} ms' + (f'  imports {", ".join(eager)}' if eager else ''))
+
+        if eager:
+            problems.append(f'{package} imports {", ".join(eager)} at import time')
+        if budget_ms is not None and milliseconds > budget_ms:
+            problems.append(f'{package} takes {milliseconds:.1f} ms to import, the budget is {budget_ms} ms')
+
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('packages', nargs='*', default=list(PACKAGES))
+    parser.add_argument('--budget-ms', type=float, default=None, help='maximum cumulative import time per package')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    problems = check(args.packages, budget_ms=args.budget_ms, repeat=args.repeat)
+    for problem in problems:
+        print(f'REGRESSION {problem}')
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+"""Benchmarks for SRT generation, pagination, sync and rendering.
+
+Run with `python -m benchmarks`. Synthetic Transcribe corpora of 1 minute up to 3 hours of speech are
+generated on the fly, translations come from utils.fakes.pseudo_translate, so no network is needed.
+
+    python -m benchmarks --save-baseline benchmarks/baseline.json
+    python -m benchmarks --compare benchmarks/baseline.json --threshold 0.2
+"""
+import argparse
+import contextlib
+import copy
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import subtitle.main as subtitle
+from utils.fakes import FakeTranslate, synthetic_transcript
+import utils.algorithm as algorithm
+import utils.srtUtils as srtUtils
+
+SECONDS_PER_WORD = 0.35
+
+# Corpus name -> minutes of speech
+SIZES = {
+    '1m': 1,
+    '10m': 10,
+    '1h': 60,
+    '3h': 180,
+}
+
+# Every utils.algorithm metric as a function returning a distance, as sync expects.
+METRICS = {
+    'jaccard': algorithm.jaccard,
+    'cosine': algorithm.cosine,
+    'sorensen_dice': lambda a, b: algorithm.sorensen_dice(a, b)['sorensen_dice_distance'],
+    'levenshtein': lambda a, b: algorithm.levenshtein(a, b)['levenshtein_distance'],
+    'normalized_levenshtein': lambda a, b: algorithm.normalized_levenshtein(a, b)['norm_levenshtein_distance'],
+    'optimal_string_alignment': lambda a, b: algorithm.optimal_string_alignment(a, b)['optimal_string_alignment_distance'],   # noqa
+    'jaro_winkler': lambda a, b: algorithm.jaro_winkler(a, b)['jaro_winkler_distance'],
+    'lcs': lambda a, b: algorithm.lcs(a, b)['lcs_distance'],
+    'metric_lcs': lambda a, b: algorithm.metric_lcs(a, b)['metric_lcs_distance'],
+    'ngram': lambda a, b: algorithm.ngram(a, b)['ngram_distance'],
+}
+
+SRC_LANG = subtitle.Language.ENGLISH
+DST_LANG = subtitle.Language.SPANISH
+
+
+def make_corpus(minutes, seed=0):
+    """Return the transcript JSON, the SRT content and the pages of minutes of synthetic speech."""
+    num_words = int(minutes * 60 / SECONDS_PER_WORD)
+    transcript = synthetic_transcript(num_words, seed=seed, seconds_per_word=SECONDS_PER_WORD)
+
+    with _quiet():
+        phrases = srtUtils.getPhrasesFromTranscript(transcript)
+
+    with tempfile.TemporaryDirectory() as folder:
+        srt_file = os.path.join(folder, 'corpus.srt')
+        with _quiet():
+            srtUtils.writeSRT(phrases, srt_file)
+        with open(srt_file, 'r') as f:
+            srt_content = f.read()
+
+    return {
+        'transcript': transcript,
+        'phrases': phrases,
+        'srt': srt_content,
+        'words': num_words,
+    }
+
+
+def translated_pages(srt_content):
+    """Pages of the SRT with their pseudo-translations, ready to be synced."""
+    translator = FakeTranslate()
+    pages = subtitle.srt_to_pages(srt_content)
+
+    result = []
+    for page in pages:
+        translations = subtitle.translate_page(page, SRC_LANG, DST_LANG, translator=translator)
+        for block, raw_translation in zip(page['blocks'], translations['blocks']):
+            block['raw_translation'] = raw_translation
+        result.append((translations['full_text'], page))
+
+    return result
+
+
+def synced_pages(pages):
+    for full_text, page in pages:
+        subtitle.sync(full_text, page, algorithm.jaccard)
+
+    return [page for _, page in pages]
+
+
+def benchmarks_for(corpus, metrics, folder):
+    """Yield (name, function, units, unit name) for a corpus. The functions are timed without setup."""
+    transcript = corpus['transcript']
+    phrases = corpus['phrases']
+    srt_content = corpus['srt']
+    num_blocks = len(phrases)
+
+    yield 'getPhrasesFromTranscript', lambda: srtUtils.getPhrasesFromTranscript(transcript), corpus['words'], 'words'
+
+    srt_file = os.path.join(folder, 'bench.srt')
+    yield 'writeSRT', lambda: srtUtils.writeSRT(phrases, srt_file), num_blocks, 'blocks'
+
+    yield 'srt_to_pages', lambda: subtitle.srt_to_pages(srt_content), num_blocks, 'blocks'
+
+    pages = translated_pages(srt_content)
+    for metric in metrics:
+        algo = METRICS[metric]
+        yield (
+            f'sync[{metric}]',
+            # sync only (over)writes the 'translation' of the blocks, so the pages can be reused.
+            lambda algo=algo: [subtitle.sync(full_text, page, algo) for full_text, page in pages],
+            num_blocks,
+            'blocks'
+        )
+
+    yield (
+        'sync_minhash',
+        lambda: [subtitle.sync_minhash(full_text, page) for full_text, page in pages],
+        num_blocks,
+        'blocks'
+    )
+
+    sentences = [block['raw_translation'] for _, page in pages for block in page['blocks']]
+    yield 'wrap_sentence', lambda: [subtitle.wrap_sentence(sentence) for sentence in sentences], len(sentences), 'sentences'
+
+    rendered = synced_pages(copy.deepcopy(pages))
+    yield 'render_srt_page', lambda: [subtitle.render_srt_page(page, 1) for page in rendered], num_blocks, 'blocks'
+
+
+def measure(func, repeat):
+    """Best wall time of repeat runs, and the peak traced memory of one extra run."""
+    timings = []
+    for _ in range(repeat):
+        with _quiet():
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    with _quiet():
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return min(timings), peak
+
+
+def run(sizes, metrics, repeat=3):
+    results = {}
+
+    for size in sizes:
+        corpus = make_corpus(SIZES[size])
+
+        with tempfile.TemporaryDirectory() as folder:
+            for name, func, units, unit_name in benchmarks_for(corpus, metrics, folder):
+                seconds, peak = measure(func, repeat)
+                key = f'{name}@{size}'
+                results[key] = {
+                    'seconds': seconds,
+                    'throughput': units / seconds if seconds else float('inf'),
+                    'unit': unit_name,
+                    'peak_memory_bytes': peak,
+                }
+                print(f'{key:<40} {seconds * 1000:10.2f} ms {results[key]["throughput"]:12.0f} {unit_name}/s '
+                      f'{peak / (1024 * 1024):8.2f} MB peak')
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the benchmarks that got slower than the baseline by more than threshold (a fraction)."""
+    regressions = []
+
+    for key, result in results.items():
+        reference = baseline['results'].get(key)
+        if reference is None:
+            continue
+
+        change = result['seconds'] / reference['seconds'] - 1 if reference['seconds'] else 0.0
+        if change > threshold:
+            regressions.append((key, reference['seconds'], result['seconds'], change))
+
+    return regressions
+
+
+def save_baseline(results, path):
+    with open(path, 'w') as f:
+        json.dump({
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'created': time.time(),
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['1m', '10m', '1h'])
+    parser.add_argument('--metrics', nargs='+', choices=list(METRICS), default=['jaccard'],
+                        help='metrics to benchmark sync with')
+    parser.add_argument('--all-metrics', action='store_true', help='benchmark sync with every metric')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save-baseline', metavar='PATH')
+    parser.add_argument('--compare', metavar='PATH', help='baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown before flagging, 0.2 = 20%%')
+    args = parser.parse_args(argv)
+
+    metrics = list(METRICS) if args.all_metrics else args.metrics
+    results = run(args.sizes, metrics, repeat=args.repeat)
+
+    if args.save_baseline:
+        save_baseline(results, args.save_baseline)
+        print(f'==> Baseline written to {args.save_baseline}')
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after, change in regressions:
+            print(f'REGRESSION {key}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms (+{change:.0%})')
+
+        if regressions:
+            return 1
+
+        print('==> No regressions')
+
+    return 0
+
+
+@contextlib.contextmanager
+def _quiet():
+    # The srtUtils functions print progress, which would be timed as well.
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+if __name__ == '__main__':
+    sys.exit(main())
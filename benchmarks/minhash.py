@@ -0,0 +1,83 @@
+"""Accuracy versus speed of subtitle.sync_minhash against the exact sync with algorithm.jaccard.
+
+Accuracy is the share of blocks that get exactly the same translation as the exact sync assigns.
+Like subtitle.sync_page, pages shorter than subtitle.MINHASH_MIN_WORDS words are synced exactly.
+
+    python -m benchmarks.minhash --sizes 10m 1h --num-perm 16 32 64 128
+"""
+import argparse
+import copy
+import sys
+import time
+
+import subtitle.main as subtitle
+import utils.algorithm as algorithm
+
+from .main import SIZES, make_corpus, translated_pages
+
+
+def timed_sync(pages, sync):
+    pages = copy.deepcopy(pages)
+
+    start = time.perf_counter()
+    synced = [sync(full_text, page) for full_text, page in pages]
+
+    return time.perf_counter() - start, synced
+
+
+def approximate_sync(text, page, **kwargs):
+    if len(text.split(' ')) < subtitle.MINHASH_MIN_WORDS:
+        return subtitle.sync(text, page, algorithm.jaccard)
+
+    return subtitle.sync_minhash(text, page, **kwargs)
+
+
+def agreement(reference, synced):
+    total = equal = 0
+    for reference_page, page in zip(reference, synced):
+        for reference_block, block in zip(reference_page['blocks'], page['blocks']):
+            total += 1
+            equal += reference_block.get('translation') == block.get('translation')
+
+    return equal / total if total else 1.0
+
+
+def report(sizes, signature_sizes, bands, shortlist_size):
+    rows = []
+
+    for size in sizes:
+        pages = translated_pages(make_corpus(SIZES[size])['srt'])
+
+        exact_seconds, reference = timed_sync(pages, lambda text, page: subtitle.sync(text, page, algorithm.jaccard))
+        rows.append((size, 'exact', exact_seconds, 1.0))
+
+        for num_perm in signature_sizes:
+            seconds, synced = timed_sync(pages, lambda text, page: approximate_sync(
+                text, page, num_perm=num_perm, bands=min(bands, num_perm), shortlist_size=shortlist_size
+            ))
+            rows.append((size, f'minhash[{num_perm}]', seconds, agreement(reference, synced)))
+
+    print(f'{"corpus":<8} {"mode":<16} {"seconds":>10} {"speedup":>8} {"accuracy":>9}')
+    exact = {}
+    for size, mode, seconds, accuracy in rows:
+        exact.setdefault(size, seconds)
+        print(f'{size:<8} {mode:<16} {seconds:10.3f} {exact[size] / seconds:7.2f}x {accuracy:9.1%}')
+
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['10m', '1h'])
+    parser.add_argument('--num-perm', nargs='+', type=int, default=[16, 32, 64, 128])
+    parser.add_argument('--bands', type=int, default=16)
+    parser.add_argument('--shortlist-size', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    report(args.sizes, args.num_perm, args.bands, args.shortlist_size)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,14 @@
 from .main import (
     download_audio,
     download_video,
+    download_stream,
+    iter_stream_chunks,
+    merge_av_files,
+    mux_subtitles,
+    transcode_to_file,
+    transcode_to_s3,
+    MediaFormat,
+    MuxMode,
+    Resolution,
 )
+from .library import MediaLibrary
@@ -0,0 +1,166 @@
+from contextlib import closing
+import os
+import sqlite3
+import threading
+import time
+
+from utils.artifacts import file_hash
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS media (
+    video_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    file_format TEXT NOT NULL,
+    quality TEXT NOT NULL,
+    itag INTEGER,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_accessed REAL NOT NULL,
+    PRIMARY KEY (video_id, kind, file_format, quality)
+);
+CREATE INDEX IF NOT EXISTS media_sha256 ON media (sha256);
+'''
+
+
+class MediaLibrary:
+    """On-disk SQLite index of downloaded media, keyed by video id, kind, format and quality.
+
+    The quality is the audio bitrate (e.g. '128kbps') or the video resolution (e.g. '720p'), or the
+    quality a download asked for (e.g. BEST_AUDIO) when that differs from what it got.
+
+    The connection is shared by the threads using the library, a lock serializes them.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def lookup(self, video_id, kind, file_format, quality=None):
+        """Return the best indexed entry whose file still exists, or None.
+
+        Without a quality the entry with the highest numeric quality is returned.
+        """
+        query = 'SELECT * FROM media WHERE video_id = ? AND kind = ? AND file_format = ?'
+        params = [video_id, kind, file_format]
+        if quality is not None:
+            query += ' AND quality = ?'
+            params.append(quality)
+
+        with self._lock, closing(self.connection.cursor()) as cursor:
+            rows = cursor.execute(query, params).fetchall()
+
+        for row in sorted(rows, key=lambda x: _quality_value(x['quality']), reverse=True):
+            if os.path.exists(row['path']):
+                self._touch(row)
+                return dict(row)
+
+        return None
+
+    def add(self, video_id, kind, file_format, quality, path, itag=None):
+        now = time.time()
+        entry = {
+            'video_id': video_id,
+            'kind': kind,
+            'file_format': file_format,
+            'quality': quality,
+            'itag': itag,
+            'path': path,
+            'size': os.path.getsize(path),
+            'sha256': file_hash(path),
+            'created': now,
+            'last_accessed': now,
+        }
+
+        with self._lock, self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO media VALUES '
+                '(:video_id, :kind, :file_format, :quality, :itag, :path, :size, :sha256, :created, :last_accessed)',
+                entry
+            )
+
+        return entry
+
+    def query(self, video_ids=None, kind=None, sha256=None):
+        """Return all entries matching the given filters, for bulk lookups."""
+        clauses = []
+        params = []
+        if video_ids is not None:
+            video_ids = list(video_ids)
+            clauses.append(f'video_id IN ({",".join("?" * len(video_ids))})')
+            params.extend(video_ids)
+        if kind is not None:
+            clauses.append('kind = ?')
+            params.append(kind)
+        if sha256 is not None:
+            clauses.append('sha256 = ?')
+            params.append(sha256)
+
+        query = 'SELECT * FROM media'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+
+        with self._lock, closing(self.connection.cursor()) as cursor:
+            return [dict(row) for row in cursor.execute(query, params)]
+
+    def gc(self, max_age_seconds=None, max_total_bytes=None, delete_files=True):
+        """Drop stale entries and return them.
+
+        Entries whose file is gone are always dropped. Then entries not accessed for max_age_seconds,
+        and finally the least recently accessed ones until the total size fits in max_total_bytes.
+        """
+        entries = sorted(self.query(), key=lambda x: x['last_accessed'])
+        now = time.time()
+
+        stale = [entry for entry in entries if not os.path.exists(entry['path'])]
+        if max_age_seconds is not None:
+            stale += [
+                entry for entry in entries
+                if entry not in stale and now - entry['last_accessed'] > max_age_seconds
+            ]
+
+        if max_total_bytes is not None:
+            remaining = [entry for entry in entries if entry not in stale]
+            total_bytes = sum(entry['size'] for entry in remaining)
+            for entry in remaining:
+                if total_bytes <= max_total_bytes:
+                    break
+                stale.append(entry)
+                total_bytes -= entry['size']
+
+        with self._lock, self.connection:
+            for entry in stale:
+                self.connection.execute(
+                    'DELETE FROM media WHERE video_id = ? AND kind = ? AND file_format = ? AND quality = ?',
+                    (entry['video_id'], entry['kind'], entry['file_format'], entry['quality'])
+                )
+
+        if delete_files:
+            # Several entries may point to the same file, only delete it when none is left.
+            indexed_paths = {entry['path'] for entry in self.query()}
+            for entry in stale:
+                if os.path.exists(entry['path']) and entry['path'] not in indexed_paths:
+                    os.remove(entry['path'])
+
+        return stale
+
+    def _touch(self, row):
+        with self._lock, self.connection:
+            self.connection.execute(
+                'UPDATE media SET last_accessed = ? WHERE video_id = ? AND kind = ? AND file_format = ? AND quality = ?',
+                (time.time(), row['video_id'], row['kind'], row['file_format'], row['quality'])
+            )
+
+
+def _quality_value(quality):
+    digits = ''.join(c for c in quality if c.isdigit())
+    return int(digits) if digits else 0
@@ -1,10 +1,19 @@
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import os
 import shutil
 import tempfile
+import threading
+import time
 
-import ffmpeg
-from pytube import YouTube
+import utils.metrics as metrics
+
+# pytube, ffmpeg-python and requests are imported where they are used, so importing this package
+# (e.g. for MediaFormat or the media library) stays cheap.
+
+DOWNLOAD_CHUNK_SIZE = 9 * 1024 * 1024   # Bytes per range request, same as pytube's default
+CHUNK_READ_SIZE = 64 * 1024
+BEST_AUDIO = 'best'     # The library quality of a download that asked for the highest bitrate
 
 
 class MediaFormat(Enum):
@@ -12,37 +21,151 @@ class MediaFormat(Enum):
     MP4 = 'mp4'
 
 
+class MuxMode(Enum):
+    COPY = 'copy'           # Remux the streams as-is, no transcoding
+    REENCODE = 'reencode'   # Full filter graph, only needed for incompatible codecs/containers
+
+
+# ISO 639-2 codes, the form MP4 and MKV language tags take.
+SUBTITLE_LANGUAGE_TAGS = {
+    'en': 'eng',
+    'nl': 'nld',
+    'es': 'spa',
+    'pt': 'por',
+    'he': 'heb',
+}
+
+# Subtitle codec per container, both are text formats that can be written without touching the other streams.
+SUBTITLE_CODECS = {
+    '.mp4': 'mov_text',
+    '.m4v': 'mov_text',
+    '.mov': 'mov_text',
+    '.mkv': 'srt',
+}
+
+
 class Resolution(Enum):
     RES_144P = '144p'
     RES_240P = '240p'
     RES_360P = '360p'
     RES_480P = '480p'
     RES_720P_HD = '720p'
-    RES_1080P_FULLHD = '1081p'
+    RES_1080P_FULLHD = '1080p'
 
 
-def download_audio(url, folder, file_format=MediaFormat.MP4):
-    yt = YouTube(url)
+def download_audio(url, folder, file_format=MediaFormat.MP4, yt=None, transcode_format=None, s3=None,
+                   library=None, abr=None):
+    """Download the highest bitrate audio stream of a video, or the stream with bitrate abr (e.g. '128kbps').
 
-    filtered_streams = yt.streams.filter(only_audio=True, subtype=file_format.value)
+    With a transcode_format the downloaded chunks are piped straight into ffmpeg and only the encoded
+    output is kept. Passing an S3 instance as well uploads that output without it ever touching the disk.
+    With a MediaLibrary, a file downloaded before is returned without contacting YouTube for the streams.
+
+    Returns:
+        str: The path of the audio file, or its S3 uri when uploaded.
+    """
+    if yt is None:
+        from pytube import YouTube
+        yt = YouTube(url)
+    output_format = transcode_format or file_format
+
+    if library is not None and s3 is None:
+        # The video id is parsed from the url, this does not fetch anything yet.
+        entry = library.lookup(yt.video_id, kind='audio', file_format=output_format.value, quality=abr or BEST_AUDIO)
+        if entry:
+            print(f'==> Found audio for {yt.video_id} in the media library')
+            return entry['path']
+
+    stream = select_audio_stream(yt, file_format, abr)
+
+    if not stream:
+        return None
 
-    if filtered_streams:
-        # We always want the highest bitrate available to be saved
-        streams_sorted_bitrate = sorted(filtered_streams, key=lambda x: int(x.abr.replace('kbps', '')), reverse=True)
+    filename = audio_filename(yt, stream, output_format)
+    if s3 is None:
+        os.makedirs(folder, exist_ok=True)
 
-        stream = next(stream for stream in streams_sorted_bitrate)
-        bitrate = stream.abr
+    if transcode_format is None:
+        report = download_stream(stream.url, f'{folder}/{filename}', filesize=stream.filesize)
+        print_throughput('audio', report)
+        file_path = report['path']
+    else:
+        chunks = iter_stream_chunks(stream.url, filesize=stream.filesize)
 
-        # For some reason I cannot get the correct title
-        filename = f'AUDIO_{bitrate}_{yt.author}_{yt.title}'[:100] + f'_{yt.video_id}.{file_format.value}'
-        stream.download(output_path=folder, filename=filename)
+        if s3 is not None:
+            return transcode_to_s3(chunks, s3, key=filename, file_format=transcode_format)
 
-        return f'{folder}/{filename}'
+        file_path = transcode_to_file(chunks, f'{folder}/{filename}', file_format=transcode_format)
 
+    if library is not None:
+        # Indexed under the bitrate asked for, which is what is looked up, and under the one it got.
+        for quality in {abr or BEST_AUDIO, stream.abr}:
+            library.add(yt.video_id, kind='audio', file_format=output_format.value, quality=quality,
+                        path=file_path, itag=stream.itag)
 
-def download_video(url, folder, resolution=Resolution.RES_1080P_FULLHD, file_format=MediaFormat.MP4):
+    return file_path
+
+
+def download_video(url, folder, resolution=Resolution.RES_1080P_FULLHD, file_format=MediaFormat.MP4,
+                   scratch_folder=None, library=None):
+    scratch_folder = scratch_folder or tempfile.gettempdir()
+
+    from pytube import YouTube
+
+    # A single metadata fetch serves both the video and the audio stream.
     yt = YouTube(url)
 
+    if library is not None:
+        # The video id is parsed from the url, the streams are not fetched until a download is needed.
+        entry = library.lookup(yt.video_id, kind='video', file_format=file_format.value, quality=resolution.value)
+        if entry:
+            print(f'==> Found video for {yt.video_id} in the media library')
+            return entry['path']
+
+    video_stream = select_video_stream(yt, resolution, file_format)
+    audio_stream = select_audio_stream(yt, file_format)
+
+    video_filename = f'VIDEO_{video_stream.resolution}_{yt.author}_{yt.title}_{yt.video_id}.{video_stream.subtype}'
+    video_path = f'{scratch_folder}/{video_filename}'
+    audio_path = f'{scratch_folder}/{audio_filename(yt, audio_stream, file_format)}'
+    os.makedirs(scratch_folder, exist_ok=True)
+    os.makedirs(folder, exist_ok=True)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        video_future = executor.submit(download_stream, video_stream.url, video_path, video_stream.filesize)
+        audio_future = executor.submit(download_stream, audio_stream.url, audio_path, audio_stream.filesize)
+        print_throughput('video', video_future.result())
+        print_throughput('audio', audio_future.result())
+
+    merge_av_files(video_path, audio_path)
+    os.remove(audio_path)
+
+    final_filepath = f'{folder}/{video_filename}'
+    shutil.move(video_path, final_filepath)
+
+    if library is not None:
+        # Indexed under the resolution asked for, which is what is looked up, and under the one it got.
+        for quality in {resolution.value, video_stream.resolution}:
+            library.add(yt.video_id, kind='video', file_format=file_format.value, quality=quality,
+                        path=final_filepath, itag=video_stream.itag)
+
+    return final_filepath
+
+
+def select_audio_stream(yt, file_format, abr=None):
+    filtered_streams = yt.streams.filter(only_audio=True, subtype=file_format.value)
+
+    if not filtered_streams:
+        return None
+
+    if abr is not None:
+        return next((stream for stream in filtered_streams if stream.abr == abr), None)
+
+    # We always want the highest bitrate available to be saved
+    return max(filtered_streams, key=lambda x: int(x.abr.replace('kbps', '')))
+
+
+def select_video_stream(yt, resolution, file_format):
     filtered_streams = yt.streams.filter(progressive=True, subtype=file_format.value)
     filtered_streams = sorted(
         filtered_streams,
@@ -50,35 +173,293 @@ def download_video(url, folder, resolution=Resolution.RES_1080P_FULLHD, file_for
         reverse=True
     )
     highest_res_stream = next(iter(filtered_streams))
-    video_stream = next(
+
+    return next(
         (stream for stream in filtered_streams if stream.resolution == resolution.value),   # or else,
         highest_res_stream
     )
 
-    video_filename = f'VIDEO_{video_stream.resolution}_{yt.author}_{yt.title}_{yt.video_id}.{video_stream.subtype}'
-    video_stream.download(output_path='/tmp', filename=video_filename)
-    audio_filename = download_audio(url, folder='/tmp')
 
-    merge_av_files(f'/tmp/{video_filename}', audio_filename)
+def audio_filename(yt, stream, file_format):
+    # For some reason I cannot get the correct title
+    return f'AUDIO_{stream.abr}_{yt.author}_{yt.title}'[:100] + f'_{yt.video_id}.{file_format.value}'
 
-    final_filepath = f'{folder}/{video_filename}'
-    shutil.move(f'/tmp/{video_filename}', final_filepath)
 
-    return final_filepath
+def download_stream(stream_url, file_path, filesize=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Download a media stream to disk in consecutive HTTP range requests.
+
+    Returns:
+        dict: The path written, the number of bytes and the elapsed seconds.
+    """
+    start = time.perf_counter()
+    downloaded = 0
+
+    with open(file_path, 'wb') as f:
+        for chunk in iter_stream_chunks(stream_url, filesize=filesize, chunk_size=chunk_size):
+            f.write(chunk)
+            downloaded += len(chunk)
+
+    seconds = time.perf_counter() - start
+    metrics.observe('download_seconds', seconds)
+
+    return {
+        'path': file_path,
+        'bytes': downloaded,
+        'seconds': seconds,
+    }
+
+
+def iter_stream_chunks(stream_url, filesize=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Yield the bytes of a media stream, fetched in consecutive HTTP range requests.
+
+    Servers that ignore the Range header answer with the full body, which is then yielded in one go. When
+    the server does not know the total size either, the rest is fetched in one open-ended range request.
+    """
+    import requests
+
+    downloaded = 0
+    requests_made = 0
+    open_ended = False
+
+    with requests.Session() as session:
+        while filesize is None or downloaded < filesize:
+            range_end = downloaded + chunk_size - 1
+            if filesize is not None:
+                range_end = min(range_end, filesize - 1)
+            byte_range = f'bytes={downloaded}-' if open_ended else f'bytes={downloaded}-{range_end}'
+
+            response = session.get(stream_url, headers={'Range': byte_range}, stream=True)
+            if open_ended and response.status_code == 416:
+                break  # Nothing was left after the previous part
+            response.raise_for_status()
+            requests_made += 1
+
+            for chunk in response.iter_content(chunk_size=CHUNK_READ_SIZE):
+                downloaded += len(chunk)
+                yield chunk
 
+            if open_ended or response.status_code != 206 or response.headers.get('Content-Length') == '0':
+                break
 
-def merge_av_files(video_file, audio_file):
-    merged_filename = tempfile.NamedTemporaryFile().name + '.' + video_file.split('.')[-1]
+            if filesize is None:
+                # The total size is announced in the Content-Range header as 'bytes start-end/total',
+                # or as 'bytes start-end/*' when it is unknown.
+                total = response.headers.get('Content-Range', '').split('/')[-1]
+                if total.isdigit():
+                    filesize = int(total)
+                elif downloaded <= range_end:
+                    break  # A short part is the end of the stream
+                else:
+                    open_ended = True
+
+    metrics.inc('download_bytes_total', downloaded)
+    metrics.inc('download_requests_total', requests_made)
+
+
+def transcode_to_file(chunks, output_path, file_format):
+    """Pipe the chunks through ffmpeg, only the encoded output is written to disk.
+
+    When the download or ffmpeg fails no partial file is left behind.
+    """
+    process = _start_transcoder(output_path, file_format, pipe_stdout=False)
+    try:
+        _feed_transcoder(process, chunks)
+        _wait_transcoder(process)
+    except BaseException:
+        _kill_transcoder(process)
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        raise
+
+    return output_path
+
+
+def transcode_to_s3(chunks, s3, key, file_format):
+    """Pipe the chunks through ffmpeg and upload its output to S3 as a multipart upload while it is produced.
+
+    When the download or ffmpeg fails the upload is aborted and the error is raised, a truncated object
+    is never left under key.
+    """
+    process = _start_transcoder('pipe:', file_format, pipe_stdout=True)
+
+    # ffmpeg's stdout has to be drained while its stdin is fed, otherwise both sides block.
+    feeder_errors = []
+    feeder = threading.Thread(target=_feed_transcoder, args=(process, chunks, feeder_errors), daemon=True)
+    feeder.start()
+    try:
+        uri = s3.upload_stream(_TranscoderOutput(process, feeder, feeder_errors), key=key)
+    except BaseException:
+        _kill_transcoder(process)
+        feeder.join()
+        raise
+
+    feeder.join()
+    try:
+        if feeder_errors:
+            raise feeder_errors[0]
+        _wait_transcoder(process)
+    except BaseException:
+        # Only reached when the uploader stopped reading before the end of the stream.
+        _kill_transcoder(process)
+        s3.delete(key=key)
+        raise
+
+    return uri
+
+
+class _TranscoderOutput:
+    """ffmpeg's stdout, which raises instead of ending when the input was cut short or ffmpeg failed.
+
+    upload_stream then fails before it completes the multipart upload, and the upload is aborted.
+    """
+
+    def __init__(self, process, feeder, feeder_errors):
+        self._process = process
+        self._feeder = feeder
+        self._feeder_errors = feeder_errors
+
+    def read(self, size=-1):
+        data = self._process.stdout.read(size)
+        if not data or size is None or size < 0:
+            self._feeder.join()
+            if self._feeder_errors:
+                raise self._feeder_errors[0]
+            _wait_transcoder(self._process)
+
+        return data
+
+
+def _start_transcoder(output, file_format, pipe_stdout):
+    import ffmpeg
+
+    output_kwargs = {'format': file_format.value}
+    if file_format == MediaFormat.MP4 and output == 'pipe:':
+        # A regular MP4 needs a seekable output to write its index, fragments do not.
+        output_kwargs['movflags'] = 'frag_keyframe+empty_moov'
+
+    return (
+        ffmpeg
+        .input('pipe:')
+        .output(output, vn=None, **output_kwargs)
+        .global_args('-loglevel', 'error')
+        .run_async(pipe_stdin=True, pipe_stdout=pipe_stdout, overwrite_output=True)
+    )
+
+
+def _feed_transcoder(process, chunks, errors=None):
+    """Write the chunks to ffmpeg's stdin. A failure of chunks is raised, or appended to errors when given."""
+    try:
+        for chunk in chunks:
+            process.stdin.write(chunk)
+    except BrokenPipeError:
+        pass    # ffmpeg exited early, the return code tells why
+    except Exception as e:
+        if errors is None:
+            raise
+        errors.append(e)
+    finally:
+        process.stdin.close()
+
+
+def _wait_transcoder(process):
+    import ffmpeg
+
+    if process.wait() != 0:
+        raise ffmpeg.Error('ffmpeg', None, None)
+
+
+def _kill_transcoder(process):
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def print_throughput(label, report):
+    megabytes = report['bytes'] / (1024 * 1024)
+    seconds = report['seconds']
+    rate = megabytes / seconds if seconds else 0.0
+    print(f'==> Downloaded {label} stream: {megabytes:.1f} MB in {seconds:.2f}s ({rate:.2f} MB/s)')
+
+
+def merge_av_files(video_file, audio_file, mode=MuxMode.COPY):
+    # Write next to the video so the final replace is a rename and not a cross-device copy.
+    root, extension = os.path.splitext(video_file)
+    merged_filename = f'{root}.merging{extension}'
+
+    import ffmpeg
 
     input_video = ffmpeg.input(video_file)
     input_audio = ffmpeg.input(audio_file)
 
-    ffmpeg.concat(input_video, input_audio, v=1, a=1).output(merged_filename).run(overwrite_output=False)
+    start = time.perf_counter()
+
+    try:
+        if mode == MuxMode.COPY:
+            try:
+                ffmpeg.output(
+                    input_video['v:0'], input_audio['a:0'], merged_filename,
+                    vcodec='copy', acodec='copy',
+                ).run(overwrite_output=True, quiet=True)
+            except ffmpeg.Error:
+                print(f'==> Stream copy not possible for {audio_file}, falling back to re-encoding')
+                mode = MuxMode.REENCODE
+
+        if mode == MuxMode.REENCODE:
+            ffmpeg.concat(input_video, input_audio, v=1, a=1).output(merged_filename).run(overwrite_output=True)
+
+        elapsed = time.perf_counter() - start
+        metrics.observe('merge_seconds', elapsed, mode=mode.value)
+        print(f'==> Merged audio and video ({mode.value}) in {elapsed:.2f}s')
+
+        os.replace(merged_filename, video_file)
+    finally:
+        # Left behind only when merging failed, the replace moves it otherwise.
+        if os.path.exists(merged_filename):
+            os.remove(merged_filename)
+
+    return video_file
+
+
+def mux_subtitles(video_file, subtitle_files, output_file=None):
+    """Add SRT files as soft subtitle tracks to a video, copying its video and audio streams as they are.
+
+    Args:
+        video_file (str): An MP4 (tracks become mov_text) or MKV (tracks stay srt) file.
+        subtitle_files (dict): SRT file per language, a language code ('es') or subtitle.Language.
+        output_file (str): Where to write the result, by default the video file is replaced.
+
+    Returns:
+        str: The path of the video with the subtitle tracks.
+    """
+    extension = os.path.splitext(output_file or video_file)[1].lower()
+    if extension not in SUBTITLE_CODECS:
+        raise ValueError(f'Cannot add subtitle tracks to {extension} files, only to {", ".join(SUBTITLE_CODECS)}')
+
+    root, _ = os.path.splitext(video_file)
+    muxed_filename = f'{root}.muxing{extension}'
+
+    import ffmpeg
+
+    input_video = ffmpeg.input(video_file)
+    streams = [input_video['v'], input_video['a?']]
+    options = {'vcodec': 'copy', 'acodec': 'copy', 'scodec': SUBTITLE_CODECS[extension]}
+
+    for i, (language, subtitle_file) in enumerate(subtitle_files.items()):
+        code = getattr(language, 'value', language)
+        streams.append(ffmpeg.input(subtitle_file)['s:0'])
+        options[f'metadata:s:s:{i}'] = f'language={SUBTITLE_LANGUAGE_TAGS.get(code, code)}'
+
+    start = time.perf_counter()
+    ffmpeg.output(*streams, muxed_filename, **options).run(overwrite_output=True, quiet=True)
+
+    elapsed = time.perf_counter() - start
+    metrics.observe('mux_subtitles_seconds', elapsed)
+    print(f'==> Added {len(subtitle_files)} subtitle tracks in {elapsed:.2f}s')
 
-    os.remove(video_file)
-    os.rename(merged_filename, video_file)
+    output_file = output_file or video_file
+    os.replace(muxed_filename, output_file)
 
-    return merged_filename
+    return output_file
 
 
 if __name__ == '__main__':
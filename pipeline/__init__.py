@@ -0,0 +1,6 @@
+from .main import (
+    Stage,
+    run_pipeline,
+    run_batch,
+    print_report,
+)
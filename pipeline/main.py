@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+import traceback
+
+from download import download_audio
+from transcribe import transcribe
+import subtitle
+import utils.aws as aws
+import utils.metrics as metrics
+
+_DONE = object()
+
+
+class Stage:
+    """A pipeline step run by a pool of worker threads.
+
+    The function receives an item (dict) and updates it in place. The input queue of the stage holds at
+    most queue_size items, so a slow stage blocks the stage feeding it instead of piling up work.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=2):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.queue_size = queue_size
+
+
+def run_pipeline(items, stages):
+    """Push the items through the stages, with all stages working concurrently.
+
+    Items that raise in a stage get an 'error' and skip the remaining stages.
+
+    Returns:
+        dict: The items, in their original order, and per-stage timing statistics.
+    """
+    items = list(items)
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages] + [queue.Queue()]
+    stats = {stage.name: {'items': 0, 'errors': 0, 'busy_seconds': 0.0, 'first_start': None, 'last_end': None}
+             for stage in stages}
+    lock = threading.Lock()
+
+    def work(index):
+        stage = stages[index]
+        stage_stats = stats[stage.name]
+
+        while True:
+            item = queues[index].get()
+            if item is _DONE:
+                break
+
+            if item.get('error') is None:
+                start = time.perf_counter()
+                try:
+                    stage.func(item)
+                except Exception as e:
+                    item['error'] = f'{stage.name}: {e!r}'
+                    item['traceback'] = traceback.format_exc()
+                end = time.perf_counter()
+
+                item['timings'][stage.name] = end - start
+                metrics.observe('pipeline_stage_seconds', end - start, stage=stage.name)
+                with lock:
+                    stage_stats['items'] += 1
+                    stage_stats['errors'] += item.get('error') is not None
+                    stage_stats['busy_seconds'] += end - start
+                    if stage_stats['first_start'] is None:
+                        stage_stats['first_start'] = start
+                    stage_stats['last_end'] = end
+
+            queues[index + 1].put(item)
+
+    pools = []
+    for index, stage in enumerate(stages):
+        threads = [threading.Thread(target=work, args=(index,), daemon=True) for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+        pools.append(threads)
+
+    start = time.perf_counter()
+    for item in items:
+        item.setdefault('timings', {})
+        item.setdefault('error', None)
+        queues[0].put(item)
+
+    # Shut the stages down in order: a stage only stops after the one before it has drained.
+    for index, threads in enumerate(pools):
+        for _ in threads:
+            queues[index].put(_DONE)
+        for thread in threads:
+            thread.join()
+    wall_seconds = time.perf_counter() - start
+
+    for stage_stats in stats.values():
+        first_start, last_end = stage_stats.pop('first_start'), stage_stats.pop('last_end')
+        stage_stats['span_seconds'] = last_end - first_start if first_start is not None else 0.0
+
+    return {
+        'items': items,
+        'stages': stats,
+        'wall_seconds': wall_seconds,
+    }
+
+
+def run_batch(urls, dst_langs, folder,
+              src_lang=subtitle.Language.ENGLISH,
+              transcribe_language=aws.Language.ENGLISH_US,
+              download_workers=2, transcribe_workers=4, srt_workers=1, translate_workers=2,
+              store=None, translator=None, transcriber=None, s3=None, translate_router=None,
+              transcribe_router=None, compress_transcripts=False):
+    """Download, transcribe, convert to SRT and translate a list of YouTube urls.
+
+    Downloads of the next videos overlap with the transcription and translation of the previous ones.
+    With an ArtifactStore (utils.artifacts), steps and translated pages completed by an earlier run are
+    skipped. Each step key contains the digest of its input, so changed inputs are processed again.
+    The translator, transcriber and s3 backends default to AWS, utils.fakes provides offline ones.
+    Translations and transcriptions are spread over the regions of translate_router and transcribe_router
+    (utils.regions.RegionRouter) when given, otherwise they run in the default region of their module.
+    With compress_transcripts the transcripts are stored gzipped, as <stem>.txt.gz instead of <stem>.txt.
+    """
+    if translate_router is not None and translator is None:
+        from utils.regions import RoutedTranslate
+
+        translator = RoutedTranslate(translate_router)
+
+    def step(item, name, key, func):
+        if store is None:
+            return func()
+
+        path = store.file_step(key, func)
+        item['digests'][name] = store.lookup(key)['artifacts']['file']
+
+        return path
+
+    def download_stage(item):
+        item['digests'] = {}
+        item['audio_file'] = step(
+            item, 'download', f'download:{item["url"]}',
+            lambda: download_audio(url=item['url'], folder=folder)
+        )
+
+    def transcribe_stage(item):
+        item['transcript_file'] = step(
+            item, 'transcribe', f'transcribe:{item["digests"].get("download")}:{transcribe_language.value}',
+            lambda: transcribe(
+                file_path=item['audio_file'],
+                language=transcribe_language,
+                out_folder=folder,
+                s3=s3,
+                transcriber=transcriber,
+                router=transcribe_router,
+                compress=compress_transcripts,
+            )
+        )
+
+    def srt_stage(item):
+        item['srt_file'] = step(
+            item, 'srt', f'srt:{item["digests"].get("transcribe")}:{src_lang.value}',
+            lambda: subtitle.write_transcript_to_srt_file(
+                transcript_file=item['transcript_file'],
+                src_language=src_lang,
+                out_folder=folder,
+            )
+        )
+
+    def translate_stage(item):
+        src_file = item['srt_file']
+        item['translations'] = {}
+        for dst_lang in dst_langs:
+            item['translations'][dst_lang.value] = step(
+                item, f'translate_{dst_lang.value}', f'translate_file:{item["digests"].get("srt")}:{dst_lang.value}',
+                lambda: subtitle.translate_srt_file(
+                    src_file=src_file,
+                    dst_file=src_file.replace(f'_{src_lang.value}.srt', f'_{dst_lang.value}.srt'),
+                    src_lang=src_lang,
+                    dst_lang=dst_lang,
+                    store=store,
+                    translator=translator,
+                )
+            )
+
+    stages = [
+        Stage('download', download_stage, workers=download_workers),
+        Stage('transcribe', transcribe_stage, workers=transcribe_workers),
+        Stage('srt', srt_stage, workers=srt_workers),
+        Stage('translate', translate_stage, workers=translate_workers),
+    ]
+
+    report = run_pipeline(({'url': url} for url in urls), stages)
+    print_report(report)
+
+    return report
+
+
+def print_report(report):
+    print(f'==> Pipeline finished in {report["wall_seconds"]:.2f}s')
+
+    for name, stage_stats in report['stages'].items():
+        print(f'    {name:<12} items={stage_stats["items"]:<4} errors={stage_stats["errors"]:<4} '
+              f'busy={stage_stats["busy_seconds"]:.2f}s span={stage_stats["span_seconds"]:.2f}s')
+
+    for item in report['items']:
+        timings = ' '.join(f'{name}={seconds:.2f}s' for name, seconds in item['timings'].items())
+        status = item['error'] or 'ok'
+        print(f'    {item["url"]}: {timings} [{status}]')
@@ -1,6 +1,7 @@
 from download import download_audio
 from transcribe import transcribe
 import subtitle
+from utils.artifacts import ArtifactStore
 import utils.aws as aws
 
 
@@ -9,28 +10,32 @@ FOLDER = '/home/wspek/dev/subtitle_shop_services/var'
 
 
 def run_sample():
-    audio_file = download_audio(
+    # Completed steps and translated pages are checkpointed here, a re-run resumes where it stopped.
+    store = ArtifactStore(f'{FOLDER}/artifacts', compress=True)
+
+    audio_file = store.file_step(f'download:{YOUTUBE_VIDEO_URL}', lambda: download_audio(
         url=YOUTUBE_VIDEO_URL,
         folder=FOLDER,
-    )
+    ))
 
-    transcript_file = transcribe(
+    transcript_file = store.file_step(f'transcribe:{audio_file}', lambda: transcribe(
         file_path=audio_file,
         language=aws.Language.ENGLISH_US,
         out_folder=FOLDER,
-    )
+    ))
 
-    source_srt_file = subtitle.write_transcript_to_srt_file(
+    source_srt_file = store.file_step(f'srt:{transcript_file}', lambda: subtitle.write_transcript_to_srt_file(
         transcript_file=transcript_file,
         src_language=subtitle.Language.ENGLISH,
         out_folder=FOLDER,
-    )
+    ))
 
     subtitle.translate_srt_file(
         src_file=source_srt_file,
         dst_file=source_srt_file.replace(subtitle.Language.ENGLISH.value, subtitle.Language.SPANISH.value),
         src_lang=subtitle.Language.ENGLISH,
         dst_lang=subtitle.Language.SPANISH,
+        store=store,
     )
 
 
@@ -0,0 +1,6 @@
+from .main import (
+    Backends,
+    SubtitleService,
+    serve,
+)
+from .jobs import JobQueue
@@ -0,0 +1,153 @@
+from contextlib import closing
+import json
+import sqlite3
+import threading
+import time
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    tenant TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queue ON jobs (status, priority DESC, id);
+'''
+
+
+class JobQueue:
+    """Persistent job queue in SQLite.
+
+    Jobs are claimed by descending priority and then in submission order, skipping tenants that already
+    have their maximum number of jobs running. Jobs that were running when the process stopped are
+    queued again on start.
+    """
+
+    def __init__(self, db_path, tenant_limits=None, default_tenant_limit=2):
+        self.db_path = db_path
+        self.tenant_limits = tenant_limits or {}
+        self.default_tenant_limit = default_tenant_limit
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+        with self._lock, self.connection:
+            self.connection.executescript(SCHEMA)
+            self.connection.execute('UPDATE jobs SET status = ?, started = NULL WHERE status = ?', (QUEUED, RUNNING))
+
+    def close(self):
+        self.connection.close()
+
+    def submit(self, kind, params, tenant='default', priority=0):
+        with self._lock, self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO jobs (kind, params, tenant, priority, status, created) VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(params), tenant, priority, QUEUED, time.time())
+            )
+            self._available.notify()
+
+        return cursor.lastrowid
+
+    def claim(self, timeout=None):
+        """Mark the next runnable job as running and return it, or None when nothing became runnable in time."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._available:
+            while True:
+                job = self._claim_next()
+                if job is not None:
+                    return job
+
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return None
+
+                self._available.wait(remaining)
+
+    def complete(self, job_id, result):
+        self._finish(job_id, DONE, result=json.dumps(result))
+
+    def fail(self, job_id, error):
+        self._finish(job_id, FAILED, error=error)
+
+    def get(self, job_id):
+        with self._lock, closing(self.connection.cursor()) as cursor:
+            row = cursor.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+        return _to_job(row) if row else None
+
+    def list(self, tenant=None, status=None, limit=100):
+        clauses = []
+        params = []
+        if tenant is not None:
+            clauses.append('tenant = ?')
+            params.append(tenant)
+        if status is not None:
+            clauses.append('status = ?')
+            params.append(status)
+
+        query = 'SELECT * FROM jobs'
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY id DESC LIMIT ?'
+        params.append(limit)
+
+        with self._lock, closing(self.connection.cursor()) as cursor:
+            return [_to_job(row) for row in cursor.execute(query, params)]
+
+    def _claim_next(self):
+        with self.connection, closing(self.connection.cursor()) as cursor:
+            running = dict(cursor.execute(
+                'SELECT tenant, COUNT(*) FROM jobs WHERE status = ? GROUP BY tenant', (RUNNING,)
+            ).fetchall())
+
+            full_tenants = [
+                tenant for tenant, count in running.items()
+                if count >= self.tenant_limits.get(tenant, self.default_tenant_limit)
+            ]
+
+            query = 'SELECT * FROM jobs WHERE status = ?'
+            if full_tenants:
+                query += f' AND tenant NOT IN ({",".join("?" * len(full_tenants))})'
+            query += ' ORDER BY priority DESC, id LIMIT 1'
+
+            row = cursor.execute(query, [QUEUED] + full_tenants).fetchone()
+            if row is None:
+                return None
+
+            cursor.execute('UPDATE jobs SET status = ?, started = ? WHERE id = ?', (RUNNING, time.time(), row['id']))
+
+        job = _to_job(row)
+        job['status'] = RUNNING
+
+        return job
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self._lock, self.connection:
+            self.connection.execute(
+                'UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ?',
+                (status, result, error, time.time(), job_id)
+            )
+            # A slot of this tenant came free, a waiting worker may now claim one of its jobs.
+            self._available.notify()
+
+
+def _to_job(row):
+    job = dict(row)
+    job['params'] = json.loads(job['params'])
+    job['result'] = json.loads(job['result']) if job['result'] else None
+
+    return job
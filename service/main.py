@@ -0,0 +1,324 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import threading
+import traceback
+from urllib.parse import parse_qs, urlparse
+
+from download import MediaLibrary, download_audio
+from transcribe import transcribe
+from transcribe.main import REGION as TRANSCRIBE_REGION, S3_BUCKET, default_regional_backends
+import subtitle
+import utils.aws as aws
+import utils.metrics as metrics
+
+from .jobs import JobQueue
+
+DEFAULT_PORT = 8080
+DEFAULT_DATA_ROOT = 'data'
+# The job params that name files or folders, they have to resolve to a path under the data root.
+PATH_PARAMS = ('folder', 'out_folder', 'file_path', 'transcript_file', 'src_file', 'dst_file')
+
+
+class Backends:
+    """Warm AWS backends shared by all workers.
+
+    Every backend is created once, on first use, and then reused: boto3 clients are thread-safe and
+    creating one costs far more than the call it is made for. Pass factories returning the fakes from
+    utils.fakes to run the service offline.
+
+    With a transcribe_router (utils.regions.RegionRouter) transcriptions are spread over its regions,
+    each with its own bucket and client, instead of running in the transcriber and s3 backends.
+    """
+
+    def __init__(self, translator_factory=None, transcriber_factory=None, s3_factory=None,
+                 transcribe_router=None, regional_transcribe_factory=None, library_factory=None):
+        self._factories = {
+            'translator': translator_factory or (lambda: aws.Translate(region=aws.Region.EU_IRELAND)),
+            'transcriber': transcriber_factory or (lambda: aws.Transcribe(region=TRANSCRIBE_REGION)),
+            's3': s3_factory or (lambda: aws.S3(region=TRANSCRIBE_REGION, bucket=S3_BUCKET)),
+            # A download.MediaLibrary, so downloads of the same video are shared between jobs.
+            'library': library_factory or (lambda: None),
+        }
+        self.transcribe_router = transcribe_router
+        self._regional_transcribe_factory = regional_transcribe_factory or default_regional_backends
+        self._instances = {}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        with self._lock:
+            if name not in self._instances:
+                factory = self._factories[name]
+                self._instances[name] = factory()
+
+            return self._instances[name]
+
+    def regional_transcribe(self, region):
+        """The bucket and Transcribe client of region, for transcriptions routed by transcribe_router."""
+        with self._lock:
+            if region not in self._instances:
+                self._instances[region] = self._regional_transcribe_factory(region)
+
+            return self._instances[region]
+
+
+def run_download(params, backends):
+    return {'audio_file': download_audio(url=params['url'], folder=params['folder'], library=backends.get('library'))}
+
+
+def run_transcribe(params, backends):
+    transcript_file = transcribe(
+        file_path=params['file_path'],
+        language=aws.Language(params['language']),
+        out_folder=params['out_folder'],
+        s3=backends.get('s3') if backends.transcribe_router is None else None,
+        transcriber=backends.get('transcriber') if backends.transcribe_router is None else None,
+        router=backends.transcribe_router,
+        regional_backends=backends.regional_transcribe,
+    )
+
+    return {'transcript_file': transcript_file}
+
+
+def run_to_srt(params, backends):
+    srt_file = subtitle.write_transcript_to_srt_file(
+        transcript_file=params['transcript_file'],
+        src_language=subtitle.Language(params['src_language']),
+        out_folder=params['out_folder'],
+    )
+
+    return {'srt_file': srt_file}
+
+
+def run_translate(params, backends):
+    dst_file = subtitle.translate_srt_file(
+        src_file=params['src_file'],
+        dst_file=params['dst_file'],
+        src_lang=subtitle.Language(params['src_lang']),
+        dst_lang=subtitle.Language(params['dst_lang']),
+        translator=backends.get('translator'),
+        incremental=params.get('incremental', False),
+    )
+
+    return {'dst_file': dst_file}
+
+
+HANDLERS = {
+    'download': run_download,
+    'transcribe': run_transcribe,
+    'to_srt': run_to_srt,
+    'translate': run_translate,
+}
+
+
+def resolve_paths(params, data_root):
+    """Return params with the paths of PATH_PARAMS resolved under data_root.
+
+    Relative paths are relative to data_root. A path that is not a string or that escapes data_root, also
+    through a symbolic link, raises a ValueError.
+    """
+    resolved = dict(params)
+    for name in PATH_PARAMS:
+        if name not in params:
+            continue
+        if not isinstance(params[name], str):
+            raise ValueError(f'The param {name} must be a path')
+
+        path = os.path.realpath(os.path.join(data_root, params[name]))
+        if os.path.commonpath([path, data_root]) != data_root:
+            raise ValueError(f'The param {name} must be a path inside the data root')
+        resolved[name] = path
+
+    return resolved
+
+
+class SubtitleService:
+    """A job queue with a pool of worker threads that keeps its AWS clients warm between jobs.
+
+    Jobs only read and write files under data_root, the paths in their params are resolved against it.
+    """
+
+    def __init__(self, db_path, workers=4, tenant_limits=None, default_tenant_limit=2, backends=None,
+                 handlers=None, data_root=DEFAULT_DATA_ROOT):
+        self.queue = JobQueue(db_path, tenant_limits=tenant_limits, default_tenant_limit=default_tenant_limit)
+        self.backends = backends or Backends()
+        self.handlers = handlers or HANDLERS
+        self.data_root = os.path.realpath(data_root)
+        self.num_workers = workers
+        self._workers = []
+        self._stopping = threading.Event()
+
+    def submit(self, kind, params, tenant='default', priority=0):
+        if kind not in self.handlers:
+            raise ValueError(f'Unknown job kind: {kind}')
+
+        params = resolve_paths(params, self.data_root)
+
+        metrics.inc('service_jobs_submitted_total', kind=kind)
+        return self.queue.submit(kind, params, tenant=tenant, priority=priority)
+
+    def start(self):
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._work, name=f'worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self):
+        self._stopping.set()
+        for worker in self._workers:
+            worker.join()
+        self.queue.close()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.queue.claim(timeout=0.5)
+            if job is None:
+                continue
+
+            try:
+                with metrics.timer('service_job_seconds', kind=job['kind']):
+                    result = self.handlers[job['kind']](job['params'], self.backends)
+            except Exception as e:
+                print(f'==> Job {job["id"]} ({job["kind"]}) failed: {e!r}')
+                self.queue.fail(job['id'], traceback.format_exc())
+                metrics.inc('service_jobs_finished_total', kind=job['kind'], status='failed')
+            else:
+                self.queue.complete(job['id'], result)
+                metrics.inc('service_jobs_finished_total', kind=job['kind'], status='done')
+
+
+def make_handler(service):
+    class JobRequestHandler(BaseHTTPRequestHandler):
+        """
+        POST /jobs              {"kind": ..., "params": {...}, "tenant": ..., "priority": ...}
+        GET  /jobs/<id>         Status, result or error of a job
+        GET  /jobs?tenant=...   Most recent jobs, optionally filtered on tenant and status
+        GET  /metrics           Prometheus metrics, when enabled
+        """
+
+        def do_POST(self):
+            if urlparse(self.path).path != '/jobs':
+                return self._send(404, {'error': 'not found'})
+
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not isinstance(body, dict) or not isinstance(body.get('params', {}), dict):
+                    raise ValueError('The body and its params must be JSON objects')
+                if not isinstance(body.get('kind'), str):
+                    raise ValueError(f'The body needs a kind, one of: {", ".join(sorted(service.handlers))}')
+                job_id = service.submit(
+                    kind=body['kind'],
+                    params=body.get('params', {}),
+                    tenant=body.get('tenant', 'default'),
+                    priority=int(body.get('priority', 0)),
+                )
+            except (KeyError, TypeError, ValueError) as e:
+                return self._send(400, {'error': str(e)})
+
+            self._send(201, {'id': job_id, 'status': 'queued'})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip('/').split('/')
+
+            if url.path == '/metrics':
+                return self._send(200, metrics.to_prometheus(), content_type='text/plain; version=0.0.4')
+
+            if parts == ['jobs']:
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                jobs = service.queue.list(
+                    tenant=query.get('tenant'),
+                    status=query.get('status'),
+                    limit=int(query.get('limit', 100)),
+                )
+                return self._send(200, {'jobs': jobs})
+
+            if len(parts) == 2 and parts[0] == 'jobs' and parts[1].isdigit():
+                job = service.queue.get(int(parts[1]))
+                if job is None:
+                    return self._send(404, {'error': 'job not found'})
+                return self._send(200, job)
+
+            self._send(404, {'error': 'not found'})
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body, content_type='application/json'):
+            data = (json.dumps(body) if content_type == 'application/json' else body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return JobRequestHandler
+
+
+def serve(db_path, host='127.0.0.1', port=DEFAULT_PORT, workers=4, tenant_limits=None, default_tenant_limit=2,
+          backends=None, data_root=DEFAULT_DATA_ROOT):
+    service = SubtitleService(
+        db_path,
+        workers=workers,
+        tenant_limits=tenant_limits,
+        default_tenant_limit=default_tenant_limit,
+        backends=backends,
+        data_root=data_root,
+    )
+    service.start()
+
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f'==> Serving jobs on http://{host}:{server.server_port} with {workers} workers')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Subtitle shop job service')
+    parser.add_argument('--db', default='jobs.sqlite3')
+    parser.add_argument('--data-root', default=DEFAULT_DATA_ROOT, help='the folder jobs read and write files in')
+    parser.add_argument('--media-library', help='SQLite index of downloaded media, shared by download jobs')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--tenant-limit', type=int, default=2, help='concurrent jobs per tenant')
+    parser.add_argument('--metrics', action='store_true', help='collect metrics, served on /metrics')
+    parser.add_argument('--translate-regions', nargs='+', choices=[region.value for region in aws.Region],
+                        help='spread Translate calls over these regions')
+    parser.add_argument('--transcribe-regions', nargs='+', choices=[region.value for region in aws.Region],
+                        help='spread Transcribe jobs over these regions')
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    from utils.regions import RegionRouter, RoutedTranslate
+
+    translate_router = None
+    if args.translate_regions:
+        translate_router = RegionRouter([aws.Region(region) for region in args.translate_regions])
+
+    transcribe_router = None
+    if args.transcribe_regions:
+        transcribe_router = RegionRouter([aws.Region(region) for region in args.transcribe_regions])
+
+    backends = Backends(
+        translator_factory=(lambda: RoutedTranslate(translate_router)) if translate_router else None,
+        transcribe_router=transcribe_router,
+        library_factory=(lambda: MediaLibrary(args.media_library)) if args.media_library else None,
+    )
+
+    serve(args.db, host=args.host, port=args.port, workers=args.workers, default_tenant_limit=args.tenant_limit,
+          backends=backends, data_root=args.data_root)
+
+
+if __name__ == '__main__':
+    main()
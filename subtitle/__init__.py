@@ -3,4 +3,5 @@ from .main import (
     write_transcript_to_srt_file,
     translate_srt_file,
     translate_srt,
+    atranslate_srt,
 )
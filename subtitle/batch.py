@@ -0,0 +1,223 @@
+"""Translation of many SRT files with asynchronous Translate batch jobs instead of a call per page.
+
+The pages of all files are packed into HTML documents, one <section> per page, and uploaded to S3 once.
+One batch job per target language translates them, after which every file is synced and rendered
+from the translated pages exactly as translate_srt does with the synchronous API.
+"""
+import copy
+from html import escape
+from html.parser import HTMLParser
+import io
+import os
+import time
+import uuid
+
+import utils.aws as aws
+import utils.compressed as compressed
+import utils.metrics as metrics
+
+from .main import render_srt_page, srt_to_pages, sync_page, translate_page
+
+REGION = aws.Region.EU_IRELAND
+S3_BUCKET = 'subtitle-shop-translate'
+ROLE_ARN_VARIABLE = 'SUBTITLE_SHOP_TRANSLATE_ROLE_ARN'
+POLL_INTERVAL = 30
+MAX_DOCUMENT_BYTES = 1024 * 1024
+RUNNING_STATUSES = ('SUBMITTED', 'IN_PROGRESS')
+
+
+def translate_srt_files_batch(src_files, src_lang, dst_langs, s3=None, batch_translator=None, translator=None,
+                              approximate=False, poll_interval=POLL_INTERVAL):
+    """Translate SRT files into every language of dst_langs with one batch job per language.
+
+    The translations are written next to the sources, named like the pipeline does (<name>_<lang>.srt).
+    Pages a job could not translate (COMPLETED_WITH_ERROR) are translated with the synchronous API.
+    The backends default to AWS, utils.fakes has FakeS3 and FakeBatchTranslate to run offline.
+
+    Returns:
+        dict: Per language code, the translated files in the order of src_files.
+    """
+    s3 = s3 or aws.S3(region=REGION, bucket=S3_BUCKET)
+    batch_translator = batch_translator or aws.BatchTranslate(role_arn=os.environ[ROLE_ARN_VARIABLE], region=REGION)
+
+    file_pages = []
+    for src_file in src_files:
+        with compressed.open_text(src_file) as f:
+            file_pages.append(srt_to_pages(f.read()))
+
+    batch_id = uuid.uuid4().hex
+    prefix = f'batch-translate/{batch_id}'
+
+    pages = [(f'p{i}-{j}', srt_page) for i, srt_pages in enumerate(file_pages) for j, srt_page in enumerate(srt_pages)]
+
+    # The input and output objects are removed however the jobs end.
+    try:
+        for n, document in enumerate(pack_documents(pages)):
+            s3.upload_stream(io.BytesIO(document.encode('utf-8')), key=f'{prefix}/input/{n:05d}.html')
+            metrics.inc('batch_translate_documents_total')
+
+        jobs = {}
+        for dst_lang in dst_langs:
+            jobs[dst_lang] = batch_translator.start_job(
+                job_name=f'subtitles_{batch_id}_{dst_lang.value}',
+                input_uri=s3.s3_uri(f'{prefix}/input/'),
+                output_uri=s3.s3_uri(f'{prefix}/output/{dst_lang.value}/'),
+                src_lang_code=src_lang.value,
+                dst_lang_code=dst_lang.value,
+            )
+
+        with metrics.timer('batch_translate_wait_seconds'):
+            statuses = wait_for_jobs(batch_translator, jobs.values(), poll_interval)
+
+        dst_files = {}
+        for dst_lang, job_id in jobs.items():
+            print(f'==> Batch translation to {dst_lang.value} {statuses[job_id].lower()}')
+            if statuses[job_id] not in ('COMPLETED', 'COMPLETED_WITH_ERROR'):
+                raise RuntimeError(f'Batch translation job {job_id} to {dst_lang.value} ended {statuses[job_id]}')
+
+            translations = download_translations(s3, batch_translator.output_uri(job_id), dst_lang)
+
+            dst_files[dst_lang.value] = []
+            for i, src_file in enumerate(src_files):
+                srt_pages = [(translations.get(f'p{i}-{j}'), srt_page) for j, srt_page in enumerate(file_pages[i])]
+                dst_file = dst_file_path(src_file, src_lang, dst_lang)
+                with open(dst_file, 'w') as f:
+                    f.write(render_translated_file(srt_pages, src_lang, dst_lang, translator, approximate))
+                dst_files[dst_lang.value].append(dst_file)
+    finally:
+        for key in s3.list_files(prefix=f'{prefix}/'):
+            s3.delete(key=key)
+
+    return dst_files
+
+
+def render_translated_file(srt_pages, src_lang, dst_lang, translator, approximate):
+    """Sync and render (translations, page) pairs, translating pages without translations synchronously."""
+    subtitles_translated_complete = ''
+    sub_counter = 1
+
+    for page_translations, srt_page in srt_pages:
+        srt_page = copy.deepcopy(srt_page)
+        if page_translations is None:
+            metrics.inc('batch_translate_fallback_pages_total')
+            page_translations = translate_page(srt_page, src_lang, dst_lang, translator)
+
+        synced_translations = sync_page(srt_page, page_translations, approximate)
+        for block, translation in zip(srt_page['blocks'], synced_translations):
+            if translation is not None:
+                block['translation'] = translation
+
+        subtitles_translated_complete += render_srt_page(srt_page, sub_counter)
+        sub_counter += len(srt_page['blocks'])
+
+    return subtitles_translated_complete
+
+
+def dst_file_path(src_file, src_lang, dst_lang):
+    path = compressed.strip_suffix(src_file)
+    stem = path[:-len('.srt')] if path.endswith('.srt') else path
+    if stem.endswith(f'_{src_lang.value}'):
+        stem = stem[:-len(f'_{src_lang.value}')]
+
+    return f'{stem}_{dst_lang.value}.srt'
+
+
+def pack_documents(pages, max_bytes=MAX_DOCUMENT_BYTES):
+    """Pack (page id, page) pairs into HTML documents of at most max_bytes, unless a single page is larger.
+
+    A page is a <section> with its full text in one <div> and every block in a <p> of another, the same
+    two texts translate_page translates.
+    """
+    header, footer = '<html><body>\n', '</body></html>\n'
+    sections = []
+    size = len(header) + len(footer)
+
+    for page_id, srt_page in pages:
+        section = (
+            f'<section id="{page_id}"><div class="full">{escape(srt_page["text"])}</div><div class="blocks">'
+            + ''.join(f'<p>{escape(block["text"])}</p>' for block in srt_page['blocks'])
+            + '</div></section>\n'
+        )
+        section_size = len(section.encode('utf-8'))
+
+        if sections and size + section_size > max_bytes:
+            yield header + ''.join(sections) + footer
+            sections = []
+            size = len(header) + len(footer)
+
+        sections.append(section)
+        size += section_size
+
+    if sections:
+        yield header + ''.join(sections) + footer
+
+
+def wait_for_jobs(batch_translator, job_ids, poll_interval=POLL_INTERVAL):
+    """Poll until no job is running any more and return the final status of every job."""
+    statuses = {}
+    pending = list(job_ids)
+
+    while pending:
+        for job_id in list(pending):
+            status = batch_translator.job_status(job_id)
+            if status not in RUNNING_STATUSES:
+                statuses[job_id] = status
+                pending.remove(job_id)
+
+        if pending:
+            time.sleep(poll_interval)
+
+    return statuses
+
+
+def download_translations(s3, output_uri, dst_lang):
+    """Read the translated documents of a job.
+
+    Returns:
+        dict: Per page id, the translations as translate_page returns them.
+    """
+    output_key = output_uri.split(f's3://{s3.bucket}/', 1)[1]
+    parser = _DocumentParser()
+
+    for key in s3.list_files(prefix=output_key):
+        if key.rsplit('/', 1)[-1].startswith(f'{dst_lang.value}.') and key.endswith('.html'):
+            parser.feed(s3.get(key).decode('utf-8'))
+            parser.close()
+
+    return {
+        page_id: {
+            'full_text': ' '.join(page['full_text'].split()),
+            'blocks': [' '.join(block.split()) for block in page['blocks']],
+        }
+        for page_id, page in parser.pages.items()
+    }
+
+
+class _DocumentParser(HTMLParser):
+    def __init__(self):
+        super().__init__()
+        self.pages = {}
+        self._page = None
+        self._field = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'section':
+            self._page = self.pages.setdefault(attrs.get('id'), {'full_text': '', 'blocks': []})
+        elif tag == 'div' and attrs.get('class') == 'full':
+            self._field = 'full_text'
+        elif tag == 'p' and self._page is not None:
+            self._page['blocks'].append('')
+            self._field = 'block'
+
+    def handle_endtag(self, tag):
+        if tag in ('div', 'p'):
+            self._field = None
+        elif tag == 'section':
+            self._page = None
+
+    def handle_data(self, data):
+        if self._field == 'full_text':
+            self._page['full_text'] += data
+        elif self._field == 'block':
+            self._page['blocks'][-1] += data
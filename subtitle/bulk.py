@@ -0,0 +1,192 @@
+"""Bulk conversion of stored Transcribe JSON files into SRT files.
+
+    python -m subtitle.bulk transcripts/ --language en --out-folder srt/
+    python -m subtitle.bulk manifest.txt --language en --out-folder srt/ --workers 8
+
+The conversion is pure CPU, so files are spread over a process pool. Every file is converted with
+write_transcript_to_srt_file, the output is the same as converting it on its own.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import os
+from pathlib import Path
+import sys
+import time
+
+from utils.artifacts import file_hash
+import utils.compressed as compressed
+import utils.metrics as metrics
+
+from .main import PAGES_SUFFIX, Language, write_transcript_to_srt_file
+
+STATE_FILE = '.bulk_srt.json'
+TRANSCRIPT_PATTERNS = ('*.json', '*.json.gz', '*.txt', '*.txt.gz')
+
+
+def find_transcripts(source):
+    """The transcript files of a directory (recursively) or a manifest with one path per line.
+
+    In a directory every *.json and *.txt file, gzipped or not, holding a JSON object is a transcript.
+    transcribe writes them as .txt, so that also skips manifests and other text files next to them.
+    """
+    source = Path(source)
+    if source.is_dir():
+        return sorted(
+            str(path)
+            for pattern in TRANSCRIPT_PATTERNS for path in source.rglob(pattern)
+            if path.name != STATE_FILE and not path.name.endswith(PAGES_SUFFIX) and _holds_json_object(path)
+        )
+
+    with open(source, 'r') as f:
+        lines = [line.strip() for line in f]
+
+    # Relative paths in a manifest are relative to the manifest itself.
+    return [str(source.parent / line) for line in lines if line and not line.startswith('#')]
+
+
+def _holds_json_object(path):
+    try:
+        with compressed.open_text(str(path)) as f:
+            return f.read(256).lstrip().startswith('{')
+    except (OSError, EOFError, UnicodeDecodeError):
+        return False
+
+
+def srt_file_path(transcript_file, src_language, out_folder, root=None):
+    """The SRT file of a transcript, in the folder that mirrors the transcript's folder under root."""
+    folder = Path(out_folder)
+    if root is not None:
+        folder = folder / os.path.relpath(os.path.dirname(os.path.abspath(transcript_file)), root)
+
+    return os.path.normpath(folder / f'{Path(compressed.strip_suffix(transcript_file)).stem}_{src_language.value}.srt')
+
+
+def common_root(transcript_files):
+    """The deepest folder holding all transcript files, their subfolders are mirrored under out_folder."""
+    if not transcript_files:
+        return None
+
+    return os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in transcript_files])
+
+
+def convert_transcripts(transcript_files, src_language, out_folder, workers=None, force=False):
+    """Convert transcripts to SRT files in out_folder, in parallel.
+
+    The subfolders of the transcripts are mirrored under out_folder. Transcripts that would still
+    be written to the same SRT file, such as x.txt next to x.json, are reported as failed, only the
+    first of them is converted.
+
+    An SRT file is up to date when it is newer than its transcript, or when the transcript still has
+    the hash it had when the SRT file was written (e.g. it was copied or touched since). Those are
+    skipped unless force is set.
+
+    Returns:
+        dict: The converted, skipped and failed ({file: error}) transcripts, and the throughput.
+    """
+    os.makedirs(out_folder, exist_ok=True)
+    state_path = os.path.join(out_folder, STATE_FILE)
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = {}
+
+    report = {'converted': [], 'skipped': [], 'failed': {}}
+    start = time.perf_counter()
+
+    root = common_root(transcript_files)
+    srt_files = {}
+    for transcript_file in transcript_files:
+        srt_file = srt_file_path(transcript_file, src_language, out_folder, root)
+        if srt_file in srt_files.values():
+            other = next(path for path, other_srt in srt_files.items() if other_srt == srt_file)
+            report['failed'][transcript_file] = f'{srt_file} is already written for {other}'
+            metrics.inc('bulk_srt_files_total', status='failed')
+            continue
+        srt_files[transcript_file] = srt_file
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {
+            executor.submit(
+                _convert, transcript_file, srt_file, src_language, force, state.get(srt_file)
+            ): transcript_file
+            for transcript_file, srt_file in srt_files.items()
+        }
+
+        for future in as_completed(futures):
+            transcript_file = futures[future]
+            try:
+                srt_file, transcript_hash, converted = future.result()
+            except Exception as e:
+                report['failed'][transcript_file] = repr(e)
+                metrics.inc('bulk_srt_files_total', status='failed')
+                continue
+
+            if transcript_hash is not None:
+                state[srt_file] = transcript_hash
+            if not converted:
+                report['skipped'].append(transcript_file)
+                metrics.inc('bulk_srt_files_total', status='skipped')
+            else:
+                report['converted'].append(transcript_file)
+                metrics.inc('bulk_srt_files_total', status='converted')
+
+    with open(state_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+
+    report['seconds'] = time.perf_counter() - start
+    report['files_per_second'] = len(report['converted']) / report['seconds'] if report['seconds'] else 0.0
+
+    return report
+
+
+def print_report(report):
+    print(f'==> Converted {len(report["converted"])} transcripts in {report["seconds"]:.2f}s '
+          f'({report["files_per_second"]:.1f} files/s), skipped {len(report["skipped"])}, '
+          f'failed {len(report["failed"])}')
+
+    for transcript_file, error in sorted(report['failed'].items()):
+        print(f'    {transcript_file}: {error}')
+
+
+def _convert(transcript_file, srt_file, src_language, force, recorded_hash):
+    """Runs in a worker process. Returns the SRT file, the transcript hash and whether it was converted.
+
+    The transcript is only hashed when the SRT file is older than it, the hash is None when it was not.
+    """
+    transcript_hash = None
+    if os.path.exists(srt_file) and not force:
+        if os.path.getmtime(srt_file) >= os.path.getmtime(transcript_file):
+            return srt_file, None, False
+
+        transcript_hash = file_hash(transcript_file)
+        if transcript_hash == recorded_hash:
+            return srt_file, transcript_hash, False
+
+    os.makedirs(os.path.dirname(srt_file), exist_ok=True)
+    write_transcript_to_srt_file(transcript_file, src_language, os.path.dirname(srt_file))
+
+    return srt_file, transcript_hash or file_hash(transcript_file), True
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='+', help='directories of transcripts, or manifests listing them')
+    parser.add_argument('--language', required=True, choices=[language.value for language in Language])
+    parser.add_argument('--out-folder', required=True)
+    parser.add_argument('--workers', type=int, default=None, help='processes, defaults to the number of cores')
+    parser.add_argument('--force', action='store_true', help='also convert transcripts that are up to date')
+    args = parser.parse_args(argv)
+
+    transcript_files = [path for source in args.sources for path in find_transcripts(source)]
+    report = convert_transcripts(
+        transcript_files, Language(args.language), args.out_folder, workers=args.workers, force=args.force
+    )
+    print_report(report)
+
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
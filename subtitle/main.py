@@ -1,15 +1,22 @@
 from enum import Enum
+import json
 from pathlib import Path
 import statistics
 
 import srt
 
-from translate import get_translation
+from translate import aget_translation, get_translation
+from utils.artifacts import content_hash
+import utils.compressed as compressed
 from utils.srtUtils import writeTranscriptToSRTFile
 import utils.algorithm as algorithm
+import utils.metrics as metrics
+import utils.minhash as minhash
 
 MAX_BYTES_IN_TRANSIT = 4500
-DEBUG_MODE = True
+PAGES_SUFFIX = '.pages.json.gz'
+MAX_CONCURRENT_PAGES = 16
+MINHASH_MIN_WORDS = 200
 
 
 class Language(Enum):
@@ -21,10 +28,10 @@ class Language(Enum):
 
 
 def write_transcript_to_srt_file(transcript_file, src_language, out_folder):
-    with open(transcript_file, 'r') as f:
+    with compressed.open_text(transcript_file) as f:
         transcription = f.read()
 
-    path = Path(transcript_file)
+    path = Path(compressed.strip_suffix(transcript_file))
     filename = path.stem
     srt_file_path = Path(out_folder) / f'{filename}_{src_language.value}.srt'
 
@@ -33,11 +40,40 @@ def write_transcript_to_srt_file(transcript_file, src_language, out_folder):
     return str(srt_file_path)
 
 
-def translate_srt_file(src_file, dst_file, src_lang, dst_lang):
-    with open(src_file, 'r') as f:
+def translate_srt_file(src_file, dst_file, src_lang, dst_lang, store=None, translator=None, approximate=False,
+                       incremental=False):
+    """Translate an SRT file into dst_file.
+
+    With incremental, the translated pages are also saved next to dst_file (PAGES_SUFFIX). When the
+    source is translated again, only pages whose text changed are sent to Translate and synced.
+    """
+    with compressed.open_text(src_file) as f:
         srt_content = f.read()
 
-    subtitles_translated_complete = translate_srt(srt_content)
+    if not incremental:
+        subtitles_translated_complete = translate_srt(
+            srt_content, src_lang, dst_lang, store=store, translator=translator, approximate=approximate
+        )
+    else:
+        pages_file = f'{dst_file}{PAGES_SUFFIX}'
+        settings = {'src_lang': src_lang.value, 'dst_lang': dst_lang.value, 'approximate': approximate}
+
+        previous_pages = []
+        try:
+            with compressed.open_text(pages_file) as f:
+                previous = json.load(f)
+            if previous['settings'] == settings:
+                previous_pages = previous['pages']
+        except FileNotFoundError:
+            pass
+
+        subtitles_translated_complete, pages = translate_srt_incremental(
+            srt_content, src_lang, dst_lang, previous_pages,
+            store=store, translator=translator, approximate=approximate
+        )
+
+        with compressed.open_text(pages_file, 'w') as f:
+            json.dump({'settings': settings, 'pages': pages}, f)
 
     with open(dst_file, 'w') as f:
         f.write(subtitles_translated_complete)
@@ -45,45 +81,192 @@ def translate_srt_file(src_file, dst_file, src_lang, dst_lang):
     return dst_file
 
 
-def translate_srt(srt_content, src_lang, dst_lang):
+def translate_srt(srt_content, src_lang, dst_lang, store=None, translator=None, approximate=False):
+    """Translate an SRT page by page.
+
+    With an ArtifactStore (utils.artifacts) every translated and synced page is checkpointed, so a
+    re-run after a failure only translates the pages that were not finished yet. The translator is
+    passed on to get_translation, e.g. a utils.fakes.FakeTranslate for offline runs. With approximate,
+    pages of at least MINHASH_MIN_WORDS translated words are synced with sync_minhash instead of sync.
+    """
     subtitles_translated_complete = ''
 
     srt_pages = srt_to_pages(srt_content)
 
     sub_counter = 1
     for num_page, srt_page in enumerate(srt_pages):
-        # Translate the full text.
-        full_text_translation = get_translation(srt_page['text'], src_lang, dst_lang)
+        synced_translations = translate_and_sync_page(srt_page, src_lang, dst_lang, store, translator, approximate)
 
-        # Translate every seperate block of the srt too.
-        srt_text = '\n'.join([block['text'] for block in srt_page['blocks']])
-        srt_block_translation = get_translation(srt_text, src_lang, dst_lang)
-        srt_translated_blocks = srt_block_translation['TranslatedText'].split('\n')
+        for block, translation in zip(srt_page['blocks'], synced_translations):
+            if translation is not None:
+                block['translation'] = translation
 
-        # Store the block translation
-        for i, translated_block in enumerate(srt_translated_blocks):
-            srt_page['blocks'][i]['raw_translation'] = translated_block
+        # Add a new translated subtitle page to the total
+        subtitles_translated_complete += render_srt_page(srt_page, sub_counter)
 
-        # Sync the page to the full text
-        synced_srt_page = sync(full_text_translation['TranslatedText'], srt_page, algorithm.jaccard)
+        sub_counter += len(srt_page['blocks'])
 
-        # Add a new translated subtitle page to the total
-        subtitles_translated_complete += render_srt_page(synced_srt_page, sub_counter)
+    return subtitles_translated_complete
+
+
+async def atranslate_srt(srt_content, src_lang, dst_lang, translator=None, approximate=False,
+                         max_concurrent_pages=MAX_CONCURRENT_PAGES):
+    """Coroutine version of translate_srt, translating up to max_concurrent_pages pages at once.
+
+    The translator is a utils.aws_async.AsyncTranslate or a utils.fakes.AsyncFakeTranslate. Pages are
+    synced in worker threads, so the event loop keeps serving other requests meanwhile.
+    """
+    import asyncio
+
+    if translator is None:
+        from utils.aws_async import AsyncTranslate, ClientPool
+
+        async with ClientPool() as pool:
+            return await atranslate_srt(
+                srt_content, src_lang, dst_lang, AsyncTranslate(pool=pool), approximate, max_concurrent_pages
+            )
+
+    semaphore = asyncio.Semaphore(max_concurrent_pages)
+
+    async def translate_and_sync(srt_page):
+        async with semaphore:
+            translations = await atranslate_page(srt_page, src_lang, dst_lang, translator)
+
+        return await asyncio.to_thread(sync_page, srt_page, translations, approximate)
+
+    srt_pages = srt_to_pages(srt_content)
+    pages_synced_translations = await asyncio.gather(*(translate_and_sync(srt_page) for srt_page in srt_pages))
+
+    subtitles_translated_complete = ''
+
+    sub_counter = 1
+    for srt_page, synced_translations in zip(srt_pages, pages_synced_translations):
+        for block, translation in zip(srt_page['blocks'], synced_translations):
+            if translation is not None:
+                block['translation'] = translation
 
-        sub_counter += len(synced_srt_page['blocks'])
+        subtitles_translated_complete += render_srt_page(srt_page, sub_counter)
+        sub_counter += len(srt_page['blocks'])
 
     return subtitles_translated_complete
 
 
+def translate_srt_incremental(srt_content, src_lang, dst_lang, previous_pages, store=None, translator=None,
+                              approximate=False):
+    """Translate an SRT, reusing the synced translations of pages that did not change.
+
+    The source is paginated so that unchanged runs of subtitles form the same pages as before (see
+    srt_to_anchored_pages), so an edit only invalidates the page it is in. Reused translations are
+    rendered with the new timings and numbering.
+
+    Returns:
+        tuple: The translated SRT content, and the pages to pass as previous_pages next time.
+    """
+    subtitles_translated_complete = ''
+    pages = []
+
+    sub_counter = 1
+    for srt_page in srt_to_anchored_pages(srt_content, previous_pages):
+        if 'previous' in srt_page:
+            synced_translations = previous_pages[srt_page['previous']]['translations']
+            metrics.inc('incremental_pages_total', status='reused')
+        else:
+            synced_translations = translate_and_sync_page(
+                srt_page, src_lang, dst_lang, store, translator, approximate
+            )
+            metrics.inc('incremental_pages_total', status='translated')
+
+        for block, translation in zip(srt_page['blocks'], synced_translations):
+            if translation is not None:
+                block['translation'] = translation
+
+        subtitles_translated_complete += render_srt_page(srt_page, sub_counter)
+        sub_counter += len(srt_page['blocks'])
+
+        pages.append({
+            'hash': page_hash(srt_page),
+            'first_text': srt_page['blocks'][0]['text'],
+            'num_blocks': len(srt_page['blocks']),
+            'translations': synced_translations,
+        })
+
+    return subtitles_translated_complete, pages
+
+
+def translate_and_sync_page(srt_page, src_lang, dst_lang, store=None, translator=None, approximate=False):
+    """Returns the synced translation of every block of the page, checkpointed in the store if given."""
+    if store is None:
+        translations = translate_page(srt_page, src_lang, dst_lang, translator)
+        return sync_page(srt_page, translations, approximate)
+
+    page_key = f'{page_hash(srt_page)}:{src_lang.value}:{dst_lang.value}'
+    translations = store.json_step(
+        f'translate:{page_key}',
+        lambda: translate_page(srt_page, src_lang, dst_lang, translator)
+    )
+
+    return store.json_step(
+        f'{"sync_minhash" if approximate else "sync"}:{page_key}:'
+        f'{content_hash(json.dumps(translations, sort_keys=True))}',
+        lambda: sync_page(srt_page, translations, approximate)
+    )
+
+
+def translate_page(srt_page, src_lang, dst_lang, translator=None):
+    # Translate the full text.
+    full_text_translation = get_translation(srt_page['text'], src_lang, dst_lang, translator=translator)
+
+    # Translate every seperate block of the srt too.
+    srt_text = '\n'.join([block['text'] for block in srt_page['blocks']])
+    srt_block_translation = get_translation(srt_text, src_lang, dst_lang, translator=translator)
+
+    return {
+        'full_text': full_text_translation['TranslatedText'],
+        'blocks': srt_block_translation['TranslatedText'].split('\n'),
+    }
+
+
+async def atranslate_page(srt_page, src_lang, dst_lang, translator=None):
+    """Coroutine version of translate_page, the full text and the blocks are translated concurrently."""
+    import asyncio
+
+    srt_text = '\n'.join([block['text'] for block in srt_page['blocks']])
+    full_text_translation, srt_block_translation = await asyncio.gather(
+        aget_translation(srt_page['text'], src_lang, dst_lang, translator=translator),
+        aget_translation(srt_text, src_lang, dst_lang, translator=translator),
+    )
+
+    return {
+        'full_text': full_text_translation['TranslatedText'],
+        'blocks': srt_block_translation['TranslatedText'].split('\n'),
+    }
+
+
+def sync_page(srt_page, translations, approximate=False):
+    # Store the block translation
+    for i, translated_block in enumerate(translations['blocks']):
+        srt_page['blocks'][i]['raw_translation'] = translated_block
+
+    # Sync the page to the full text, short pages are synced exactly (see sync_minhash)
+    approximate = approximate and len(translations['full_text'].split(' ')) >= MINHASH_MIN_WORDS
+    with metrics.timer('sync_page_seconds', mode='minhash' if approximate else 'exact'):
+        if approximate:
+            synced_srt_page = sync_minhash(translations['full_text'], srt_page)
+        else:
+            synced_srt_page = sync(translations['full_text'], srt_page, algorithm.jaccard)
+
+    return [block.get('translation') for block in synced_srt_page['blocks']]
+
+
+def page_hash(srt_page):
+    return content_hash('\n'.join(block['text'] for block in srt_page['blocks']))
+
+
 def srt_to_pages(srt_content):
     subs = list(srt.parse(srt_content))
 
     def add_page(blocks):
-        txt_content = ' '.join([block['text'] for block in blocks])
-        pages.append({
-            'text': txt_content,
-            'blocks': blocks
-        })
+        pages.append(make_page(blocks))
 
     pages = []
     blocks = []
@@ -109,6 +292,70 @@ def srt_to_pages(srt_content):
     return pages
 
 
+def srt_to_anchored_pages(srt_content, previous_pages):
+    """Paginate like srt_to_pages, but keep the pages of an earlier pagination where the text is unchanged.
+
+    Wherever the subtitles starting at a position hash to one of the previous pages, that page is
+    emitted again, marked with the index of the previous page under 'previous'. The subtitles in
+    between are paginated as usual.
+    """
+    blocks = [
+        {'text': sub.content.replace('\n', ' '), 'start': sub.start, 'end': sub.end}
+        for sub in srt.parse(srt_content)
+    ]
+
+    previous_by_first_text = {}
+    for index, previous_page in enumerate(previous_pages):
+        previous_by_first_text.setdefault(previous_page['first_text'], []).append(index)
+
+    pages = []
+    pending = []
+    total_bytes = 0
+
+    i = 0
+    while i < len(blocks):
+        match = None
+        for index in previous_by_first_text.get(blocks[i]['text'], []):
+            candidate = blocks[i:i + previous_pages[index]['num_blocks']]
+            if len(candidate) == previous_pages[index]['num_blocks'] and \
+                    page_hash({'blocks': candidate}) == previous_pages[index]['hash']:
+                match = index
+                break
+
+        if match is not None:
+            if pending:
+                pages.append(make_page(pending))
+                pending = []
+                total_bytes = 0
+
+            num_blocks = previous_pages[match]['num_blocks']
+            pages.append(dict(make_page(blocks[i:i + num_blocks]), previous=match))
+            i += num_blocks
+            continue
+
+        block_bytes = len(blocks[i]['text'].encode('utf-8'))
+        if pending and total_bytes + block_bytes > MAX_BYTES_IN_TRANSIT:
+            pages.append(make_page(pending))
+            pending = []
+            total_bytes = 0
+
+        pending.append(blocks[i])
+        total_bytes += block_bytes
+        i += 1
+
+    if pending:
+        pages.append(make_page(pending))
+
+    return pages
+
+
+def make_page(blocks):
+    return {
+        'text': ' '.join([block['text'] for block in blocks]),
+        'blocks': blocks
+    }
+
+
 def sync(translation, page, algo):
     window_size = 10
     length_ratio_threshold = 90.0
@@ -122,6 +369,7 @@ def sync(translation, page, algo):
 
         distances = []
         assembled_sentence = ''
+        i = -1  # Stays -1 when no words are left for this block
         for i, translated_word in enumerate(translated_words):
             assembled_sentence = ' '.join([assembled_sentence, translated_word]) if assembled_sentence else translated_word
             distance = algo(raw_translation, assembled_sentence)
@@ -132,7 +380,6 @@ def sync(translation, page, algo):
                 break
 
             length_ratio = calc_length_ratio(raw_translation, assembled_sentence)
-            print(distance, length_ratio)
 
             if (len(distances) >= window_size and calc_average_slope(distances, window_size) >= 0) or end_of_page(i):
                 # No match whatsoever for window_size
@@ -157,12 +404,85 @@ def sync(translation, page, algo):
 
             distances.append(distance)
 
+        metrics.observe('sync_iterations_per_block', i + 1, buckets=metrics.COUNT_BUCKETS)
+
     oneliner = ' '.join(translated_words)  # The remaining translation
     page['blocks'][-1]['translation'] = wrap_sentence(oneliner)
 
     return page
 
 
+def sync_minhash(translation, page, num_perm=64, bands=16, shortlist_size=5, max_span_factor=2.0, seed=1):
+    """Approximate variant of sync for long pages.
+
+    For every block, MinHash signatures (utils.minhash) of all spans of the remaining translated words
+    are compared with the signature of the block's raw translation. The spans sharing an LSH band with
+    it, ranked by estimated similarity, form a shortlist of at most shortlist_size boundaries that are
+    scored with the exact Jaccard distance of their shingles, the measure algorithm.jaccard computes.
+    The best scoring span becomes the block's translation.
+
+    Below MINHASH_MIN_WORDS translated words the exact sync takes a few milliseconds, less than the
+    numpy import of the first call, so sync_page only uses this from that page length on.
+
+    Args:
+        num_perm (int): Signature size, larger is more accurate and slower.
+        bands (int): LSH bands, more bands lets less similar spans through to the shortlist.
+        max_span_factor (float): Longest span considered, relative to the raw translation's word count.
+    """
+    import numpy as np
+
+    translated_words = translation.split(' ')
+    word_shingles = minhash.WordShingles(translated_words, num_perm, seed)
+    position = 0
+
+    for j, block in enumerate(page['blocks'][:-1]):
+        raw_translation = block['raw_translation']
+
+        num_raw_words = len(raw_translation.split(' '))
+        remaining_words = len(translated_words) - position
+        max_span = min(remaining_words, max(int(num_raw_words * max_span_factor), num_raw_words + 10))
+        if max_span == 0:
+            block['translation'] = ''
+            continue
+
+        spans, added_shingles = word_shingles.spans(position, max_span)
+        raw_shingles = minhash.shingles(raw_translation)
+        query = minhash.signature(raw_shingles, num_perm, seed)
+        estimates = minhash.estimated_similarity(spans, query)
+
+        candidates = minhash.lsh_candidates(spans, query, bands)
+        if len(candidates) == 0:
+            candidates = np.arange(max_span)
+        shortlist = candidates[np.argsort(-estimates[candidates], kind='stable')][:shortlist_size]
+        shortlist = {int(index) + 1 for index in shortlist}   # As span lengths
+
+        metrics.observe('sync_shortlist_size', len(shortlist), buckets=metrics.COUNT_BUCKETS)
+
+        best_distance, best_end = None, None
+        span_shingles = set()
+        for end in range(1, max(shortlist) + 1):
+            span_shingles |= added_shingles[end - 1]
+            if end not in shortlist:
+                continue
+
+            distance = minhash.jaccard_distance(raw_shingles, span_shingles)
+            # Like sync, prefer the longest span among equally good ones.
+            if best_distance is None or distance <= best_distance:
+                best_distance, best_end = distance, end
+
+        if best_distance == 1.0:
+            # Nothing in common, assume the translation is about as long as the raw translation.
+            best_end = min(num_raw_words, remaining_words)
+
+        block['translation'] = wrap_sentence(' '.join(translated_words[position:position + best_end]))
+        position += best_end
+
+    oneliner = ' '.join(translated_words[position:])  # The remaining translation
+    page['blocks'][-1]['translation'] = wrap_sentence(oneliner)
+
+    return page
+
+
 def test_end_of_page(words):
     return lambda x: len(words) == x + 1
 
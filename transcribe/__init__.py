@@ -1 +1 @@
-from .main import transcribe
+from .main import transcribe, atranscribe
@@ -2,61 +2,191 @@ from pathlib import Path
 import time
 import uuid
 
-import boto3
-import requests
-
 import utils.aws as aws
+import utils.compressed as compressed
+import utils.metrics as metrics
 
 REGION = aws.Region.SA_SAO_PAOLO
 S3_BUCKET = 'subtitle-shop'
+POLL_INTERVAL = 5
+RUNNING_STATUSES = ('QUEUED', 'IN_PROGRESS')
 
 
-def transcribe(file_path, language, out_folder):
-    path = Path(file_path)
-    file_format = path.suffix.lstrip('.')
+def transcribe(file_path, language, out_folder, s3=None, transcriber=None, poll_interval=POLL_INTERVAL,
+               compress=False, router=None, regional_backends=None):
+    """Transcribe a media file and save the Transcribe JSON in out_folder.
 
-    s3 = aws.S3(region=REGION, bucket=S3_BUCKET)
+    The transcript is streamed from Transcribe into the file, <stem>.txt, or gzipped as <stem>.txt.gz when
+    compress is set. Every reader of transcripts in this repo accepts both.
 
+    With a RegionRouter (utils.regions) the job runs in a region it chooses, with the bucket and Transcribe
+    client of that region from regional_backends(region), so the media is never transferred across
+    regions. A region that throttles the job is left for the next one. Without one, which is the default,
+    the job runs in REGION.
+    """
+    path = Path(file_path)
+
+    if router is None:
+        s3 = s3 or aws.S3(region=REGION, bucket=S3_BUCKET)
+        transcriber = transcriber or aws.Transcribe(region=REGION)
+        key, job_name = start_transcription(path, language, s3, transcriber)
+        return finish_transcription(path, out_folder, key, job_name, s3, transcriber, poll_interval, compress)
+
+    from utils.regions import is_throttling
+
+    regional_backends = regional_backends or default_regional_backends
+    tried = set()
+    while True:
+        region = router.acquire(exclude=tried)
+        s3 = None
+        try:
+            s3, transcriber = regional_backends(region)
+            key, job_name = start_transcription(path, language, s3, transcriber)
+        except Exception as e:
+            router.release(region, throttled=is_throttling(e))
+            if s3 is not None:
+                s3.delete(key=path.name)
+            tried.add(region)
+            if not is_throttling(e) or len(tried) == len(router.regions):
+                raise
+            print(f'==> Transcribe throttled in {region.value}, failing over')
+            continue
+        break
+
+    start = time.perf_counter()
+    try:
+        return finish_transcription(path, out_folder, key, job_name, s3, transcriber, poll_interval, compress)
+    finally:
+        router.release(region, seconds=time.perf_counter() - start)
+
+
+def regional_bucket(region):
+    """The bucket for media transcribed in region, every region has its own."""
+    return S3_BUCKET if region == REGION else f'{S3_BUCKET}-{region.value}'
+
+
+def default_regional_backends(region):
+    return aws.S3(region=region, bucket=regional_bucket(region)), aws.Transcribe(region=region)
+
+
+def start_transcription(path, language, s3, transcriber):
+    """Upload the media unless it is in the bucket already and start a job. Returns the S3 key and job name."""
     key = path.name
     if not s3.exists(key=key):
-        uri = s3.upload(file_path, key=key)
+        uri = s3.upload(str(path), key=key)
     else:
         uri = s3.get_object_uri(key=key)
 
-    transcribe_client = boto3.client('transcribe')
+    job_name = transcriber.start_job(**job_request(path, language, uri))
 
-    # Use the uuid functionality to generate a unique job name.
-    # Otherwise, the Transcribe service will return an error.
-    response = transcribe_client.start_transcription_job(
-        TranscriptionJobName="transcribe_" + uuid.uuid4().hex,
-        LanguageCode=language.value,
-        MediaFormat=file_format,
-        Media={"MediaFileUri": uri},
-        # Settings = { "VocabularyName" : "MyVocabulary" }
-    )
-    job_name = response["TranscriptionJob"]['TranscriptionJobName']
+    return key, job_name
 
-    def job_in_progress():
-        r = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-        return r["TranscriptionJob"]["TranscriptionJobStatus"] == "IN_PROGRESS"
 
-    while job_in_progress():
-        print('.')
-        time.sleep(5)
+def job_request(path, language, uri):
+    """The arguments of start_job for the media at uri, shared by the blocking and the coroutine API."""
+    return {
+        # Use the uuid functionality to generate a unique job name.
+        # Otherwise, the Transcribe service will return an error.
+        'job_name': "transcribe_" + uuid.uuid4().hex,
+        'media_uri': uri,
+        'language_code': language.value,
+        'media_format': path.suffix.lstrip('.'),
+    }
 
-    job = transcribe_client.get_transcription_job(TranscriptionJobName=job_name)
-    transcript_uri = job["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
-    transcript = requests.get(transcript_uri).text
 
-    transcript_file = f'{out_folder}/{path.stem}.txt'
-    with open(transcript_file, 'w') as f:
-        f.write(transcript)
+def finish_transcription(path, out_folder, key, job_name, s3, transcriber, poll_interval, compress):
+    """Wait for the job, save its transcript and remove the media from the bucket."""
+    clock = JobClock()
+    status = transcriber.job_status(job_name)
+    while status in RUNNING_STATUSES:
+        clock.update(status)
+        time.sleep(poll_interval)
+        status = transcriber.job_status(job_name)
+    clock.finish(status)
+
+    transcript_file = transcript_file_path(path, out_folder, compress)
+    with compressed.open_binary_writer(transcript_file) as f:
+        transcriber.download_transcript(job_name, f)
 
     s3.delete(key=key)
 
     return transcript_file
 
 
+def transcript_file_path(path, out_folder, compress):
+    transcript_file = f'{out_folder}/{path.stem}.txt'
+    if compress:
+        transcript_file += compressed.GZIP_SUFFIX
+
+    return transcript_file
+
+
+class JobClock:
+    """Measures the time a job spends queued and running from the statuses seen while polling it."""
+
+    def __init__(self):
+        self.submitted = time.perf_counter()
+        self.started = None
+
+    def update(self, status):
+        if status == 'IN_PROGRESS' and self.started is None:
+            self.started = time.perf_counter()
+
+    def finish(self, status):
+        finished = time.perf_counter()
+        started = self.started or finished
+        metrics.observe('transcribe_queue_seconds', started - self.submitted)
+        metrics.observe('transcribe_run_seconds', finished - started)
+        metrics.inc('transcribe_jobs_total', status=status)
+
+
+async def atranscribe(file_path, language, out_folder, s3=None, transcriber=None, poll_interval=POLL_INTERVAL,
+                      compress=False):
+    """Coroutine version of transcribe, for the backends of utils.aws_async or their fakes in utils.fakes.
+
+    Waiting for the job takes no thread, so many transcriptions can be in progress in one event loop.
+    """
+    import asyncio
+
+    if s3 is None or transcriber is None:
+        from utils.aws_async import AsyncS3, AsyncTranscribe, ClientPool
+
+        async with ClientPool() as pool:
+            return await atranscribe(
+                file_path, language, out_folder,
+                s3=s3 or AsyncS3(region=REGION, bucket=S3_BUCKET, pool=pool),
+                transcriber=transcriber or AsyncTranscribe(region=REGION, pool=pool),
+                poll_interval=poll_interval,
+                compress=compress,
+            )
+
+    path = Path(file_path)
+
+    key = path.name
+    if not await s3.exists(key=key):
+        uri = await s3.upload(str(path), key=key)
+    else:
+        uri = await s3.get_object_uri(key=key)
+
+    job_name = await transcriber.start_job(**job_request(path, language, uri))
+
+    clock = JobClock()
+    status = await transcriber.job_status(job_name)
+    while status in RUNNING_STATUSES:
+        clock.update(status)
+        await asyncio.sleep(poll_interval)
+        status = await transcriber.job_status(job_name)
+    clock.finish(status)
+
+    transcript_file = transcript_file_path(path, out_folder, compress)
+    with compressed.open_binary_writer(transcript_file) as f:
+        await transcriber.download_transcript(job_name, f)
+
+    await s3.delete(key=key)
+
+    return transcript_file
+
+
 if __name__ == '__main__':
     transcribe(
         file_path='/home/wspek/dev/subtitle-shop-services/var/AUDIO_128kbps_GMR Transcription Services Inc_How to Pass a Transcription Test | Explainer Video_xTY3kPmDrOM.mp4',     # noqa
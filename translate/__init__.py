@@ -1 +1 @@
-from .main import get_translation
+from .main import get_translation, aget_translation
@@ -1,33 +1,64 @@
 import time
 
-import boto3
-from botocore.config import Config
-from botocore.exceptions import ClientError
-
 import utils.aws as aws
+import utils.metrics as metrics
+
+RETRY_INTERVAL = 5
+
+
+def get_translation(text, src_lang, dst_lang, translator=None):
+    """Translate text, retrying while Translate refuses the call.
+
+    The translator defaults to Translate in eu-west-1. Pass a utils.regions.RoutedTranslate to spread
+    calls over several regions.
+    """
+    from botocore.exceptions import ClientError
 
+    translator = translator or aws.Translate(region=aws.Region.EU_IRELAND)
 
-def get_translation(text, src_lang, dst_lang):
-    translate_client = boto3.client(
-        service_name='translate',
-        region_name=aws.Region.EU_IRELAND.value,
-        use_ssl=True,
-        config=Config(retries={'max_attempts': 10})
-    )
+    metrics.inc('translate_calls_total')
+    metrics.inc('translate_bytes_total', len(text.encode('utf-8')))
 
     while True:
         try:
-            translation = translate_client.translate_text(
-                Text=text,
-                SourceLanguageCode=src_lang.value,
-                TargetLanguageCode=dst_lang.value
-            )
+            with metrics.timer('translate_seconds'):
+                translation = translator.translate_text(text, src_lang.value, dst_lang.value)
             break
         except ClientError as e:
+            metrics.inc('translate_retries_total')
             print(f'Client error while attempting to translate (AWS)')
             print('Sleeping...')
-            time.sleep(5)
+            time.sleep(RETRY_INTERVAL)
         except Exception as e:
             raise e
 
     return translation
+
+
+async def aget_translation(text, src_lang, dst_lang, translator=None):
+    """Coroutine version of get_translation, for a utils.aws_async.AsyncTranslate or AsyncFakeTranslate.
+
+    Pass the same translator to concurrent calls so they share its limit on requests in flight.
+    """
+    import asyncio
+
+    from botocore.exceptions import ClientError
+
+    if translator is None:
+        from utils.aws_async import AsyncTranslate
+
+        # On the shared pool of the running loop, closed with utils.aws_async.close_client_pool().
+        translator = AsyncTranslate(region=aws.Region.EU_IRELAND)
+
+    metrics.inc('translate_calls_total')
+    metrics.inc('translate_bytes_total', len(text.encode('utf-8')))
+
+    while True:
+        try:
+            with metrics.timer('translate_seconds'):
+                return await translator.translate_text(text, src_lang.value, dst_lang.value)
+        except ClientError:
+            metrics.inc('translate_retries_total')
+            print(f'Client error while attempting to translate (AWS)')
+            print('Sleeping...')
+            await asyncio.sleep(RETRY_INTERVAL)
@@ -1,40 +1,45 @@
-from strsimpy.levenshtein import Levenshtein
-from strsimpy.normalized_levenshtein import NormalizedLevenshtein
-# from strsimpy.weighted_levenshtein import WeightedLevenshtein, CharacterSubstitutionInterface
-from strsimpy.optimal_string_alignment import OptimalStringAlignment
-from strsimpy.jaro_winkler import JaroWinkler
-from strsimpy.longest_common_subsequence import LongestCommonSubsequence
-from strsimpy.metric_lcs import MetricLCS
-from strsimpy.ngram import NGram
-from strsimpy.cosine import Cosine
-from strsimpy.jaccard import Jaccard
-from strsimpy.sorensen_dice import SorensenDice
+import importlib
 # import spacy
 # import wmd
 
+# The strsimpy classes are imported on first use, most callers only ever need one of them. Instances are
+# cached as they only hold their configuration, which keeps the hot loop in subtitle.sync cheap.
+_instances = {}
+
+
+def _metric(module, class_name, *args):
+    key = (module, class_name, args)
+    instance = _instances.get(key)
+
+    if instance is None:
+        metric_class = getattr(importlib.import_module(f'strsimpy.{module}'), class_name)
+        instance = _instances[key] = metric_class(*args)
+
+    return instance
+
 
 def jaccard(base_txt, txt):
-    j = Jaccard(3)
+    j = _metric('jaccard', 'Jaccard', 3)
     return j.distance(base_txt, txt)
 
 
 def cosine(base_txt, txt):
-    c = Cosine(1)
+    c = _metric('cosine', 'Cosine', 1)
     return c.distance(base_txt, txt)
 
 
 def sorensen_dice(base_txt, txt):
-    j = SorensenDice(2)
+    j = _metric('sorensen_dice', 'SorensenDice', 2)
     return {'sorensen_dice_distance': j.distance(base_txt, txt), 'sorensen_dice_similarity': j.similarity(base_txt, txt)}
 
 
 def levenshtein(base_txt, txt):
-    l = Levenshtein()
+    l = _metric('levenshtein', 'Levenshtein')
     return {'levenshtein_distance': l.distance(s0=base_txt, s1=txt)}
 
 
 def normalized_levenshtein(base_txt, txt):
-    l = NormalizedLevenshtein()
+    l = _metric('normalized_levenshtein', 'NormalizedLevenshtein')
     return {'norm_levenshtein_distance': l.distance(s0=base_txt, s1=txt), 'norm_levenshtein_similarity': l.similarity(s0=base_txt, s1=txt)}
 
 
@@ -48,27 +53,27 @@ def normalized_levenshtein(base_txt, txt):
 
 
 def optimal_string_alignment(base_txt, txt):
-    o = OptimalStringAlignment()
+    o = _metric('optimal_string_alignment', 'OptimalStringAlignment')
     return {'optimal_string_alignment_distance': o.distance(s0=base_txt, s1=txt)}
 
 
 def jaro_winkler(base_txt, txt):
-    l = JaroWinkler()
+    l = _metric('jaro_winkler', 'JaroWinkler')
     return {'jaro_winkler_distance': l.distance(s0=base_txt, s1=txt), 'jaro_winkler_similarity': l.similarity(s0=base_txt, s1=txt)}
 
 
 def lcs(base_txt, txt):
-    lcs = LongestCommonSubsequence()
+    lcs = _metric('longest_common_subsequence', 'LongestCommonSubsequence')
     return {'lcs_distance': lcs.distance(base_txt, txt)}
 
 
 def metric_lcs(base_txt, txt):
-    l = MetricLCS()
+    l = _metric('metric_lcs', 'MetricLCS')
     return {'metric_lcs_distance': l.distance(base_txt, txt)}
 
 
 def ngram(base_txt, txt):
-    l = NGram(2)
+    l = _metric('ngram', 'NGram', 2)
     return {'ngram_distance': l.distance(base_txt, txt)}
 
 
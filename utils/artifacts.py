@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import utils.compressed as compressed
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ArtifactStore:
+    """Content-addressed artifact storage with a manifest of completed steps.
+
+    Artifacts are stored under objects/ by the sha256 of their content. The manifest maps a step key,
+    e.g. 'translate:<page hash>:en:es', to the digests and values that step produced. A step whose key
+    is in the manifest and whose artifacts are present does not have to run again.
+
+    Files are copied in and out of the store rather than linked, so a step that later rewrites its output
+    in place cannot change an object behind its digest. The manifest is a journal with a line per recorded
+    step, the last line of a step wins.
+
+    With compress, artifacts stored with put (e.g. pages and translations) are gzipped on disk. They keep
+    the digest of their uncompressed content, and get reads either form.
+    """
+
+    def __init__(self, root, compress=False):
+        self.root = root
+        self.compress = compress
+        self.objects_folder = os.path.join(root, 'objects')
+        self.manifest_file = os.path.join(root, 'manifest.jsonl')
+        self._lock = threading.Lock()
+
+        os.makedirs(self.objects_folder, exist_ok=True)
+
+        # Stores written before the manifest became a journal have it as one JSON document.
+        try:
+            with open(os.path.join(root, 'manifest.json'), 'r') as f:
+                self.manifest = json.load(f)
+        except FileNotFoundError:
+            self.manifest = {}
+
+        try:
+            with open(self.manifest_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue    # a line cut short by a crash while it was written
+                    self.manifest[entry['step']] = entry['record']
+        except FileNotFoundError:
+            pass
+
+    def put(self, data):
+        digest = content_hash(data)
+        path = self._object_path(digest)
+
+        if not os.path.exists(path):
+            _atomic_write(path, compressed.compress(data) if self.compress else data)
+
+        return digest
+
+    def get(self, digest):
+        with open(self._object_path(digest), 'rb') as f:
+            return compressed.decompress(f.read())
+
+    def put_json(self, obj):
+        return self.put(json.dumps(obj, sort_keys=True).encode('utf-8'))
+
+    def get_json(self, digest):
+        return json.loads(self.get(digest).decode('utf-8'))
+
+    def put_file(self, path):
+        """Store a copy of a file."""
+        digest = file_hash(path)
+        object_path = self._object_path(digest)
+
+        if not os.path.exists(object_path):
+            _atomic_copy(path, object_path)
+
+        return digest
+
+    def get_file(self, digest, path):
+        """Make the artifact available at path again, e.g. after it was cleaned from the work folder."""
+        if not os.path.exists(path):
+            _atomic_copy(self._object_path(digest), path)
+
+        return path
+
+    def has(self, digest):
+        return os.path.exists(self._object_path(digest))
+
+    def lookup(self, step):
+        """Return the manifest record of a completed step, or None when it has to (re)run."""
+        record = self.manifest.get(step)
+
+        if record is None or not all(self.has(digest) for digest in record.get('artifacts', {}).values()):
+            return None
+
+        return record
+
+    def record(self, step, artifacts=None, **values):
+        record = dict(values, artifacts=artifacts or {})
+
+        with self._lock:
+            self.manifest[step] = record
+            with open(self.manifest_file, 'a') as f:
+                f.write(json.dumps({'step': step, 'record': record}, sort_keys=True) + '\n')
+
+        return record
+
+    def file_step(self, step, func):
+        """Run func, which produces a file and returns its path, unless the step completed before.
+
+        Returns:
+            str: The path of the file, restored from the store when it no longer exists.
+        """
+        record = self.lookup(step)
+        if record is not None:
+            print(f'==> Skipping {step}, already completed')
+            return self.get_file(record['artifacts']['file'], record['path'])
+
+        path = func()
+        self.record(step, artifacts={'file': self.put_file(path)}, path=path)
+
+        return path
+
+    def json_step(self, step, func):
+        """Run func, which returns a JSON serializable result, unless the step completed before."""
+        record = self.lookup(step)
+        if record is not None:
+            return self.get_json(record['artifacts']['result'])
+
+        result = func()
+        self.record(step, artifacts={'result': self.put_json(result)})
+
+        return result
+
+    def _object_path(self, digest):
+        folder = os.path.join(self.objects_folder, digest[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, digest)
+
+
+def content_hash(data):
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            sha256.update(block)
+
+    return sha256.hexdigest()
+
+
+def _atomic_copy(src_path, dst_path):
+    tmp_path = f'{dst_path}.{threading.get_ident()}.tmp'
+    shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dst_path)
+
+
+def _atomic_write(path, data):
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -1,8 +1,11 @@
 from enum import Enum
+import os
 import re
 
-import boto3
-from botocore.exceptions import ClientError
+import utils.metrics as metrics
+
+# boto3, botocore and requests are imported where they are used: they take a few hundred milliseconds
+# to import, which short-lived invocations that never talk to AWS should not pay.
 
 
 class Language(Enum):
@@ -24,27 +27,171 @@ class Region(Enum):
     EU_IRELAND = 'eu-west-1'
 
 
+class Translate:
+    """Amazon Translate backend, see utils.fakes.FakeTranslate for an offline stand-in."""
+
+    def __init__(self, region=Region.EU_IRELAND, max_attempts=10):
+        import boto3
+        from botocore.config import Config
+
+        self.region = region
+        self.client = boto3.client(
+            service_name='translate',
+            region_name=region.value,
+            use_ssl=True,
+            config=Config(retries={'max_attempts': max_attempts})
+        )
+
+    def translate_text(self, text, src_lang_code, dst_lang_code):
+        """Returns the Translate response, with the translation under 'TranslatedText'."""
+        return self.client.translate_text(
+            Text=text,
+            SourceLanguageCode=src_lang_code,
+            TargetLanguageCode=dst_lang_code
+        )
+
+
+class BatchTranslate:
+    """Asynchronous Amazon Translate batch jobs, see utils.fakes.FakeBatchTranslate for an offline stand-in.
+
+    A job translates every document under an S3 prefix and writes the results, named
+    '<target language>.<document name>', to a folder under the output prefix. The role must allow
+    Translate to read the input and write the output prefix; the bucket must be in the job's region.
+    """
+
+    def __init__(self, role_arn, region=Region.EU_IRELAND):
+        import boto3
+
+        self.role_arn = role_arn
+        self.region = region
+        self.client = boto3.client('translate', region_name=region.value)
+
+    def start_job(self, job_name, input_uri, output_uri, src_lang_code, dst_lang_code, content_type='text/html'):
+        """Returns the id of the job, input_uri and output_uri are s3:// prefixes."""
+        response = self.client.start_text_translation_job(
+            JobName=job_name,
+            InputDataConfig={'S3Uri': input_uri, 'ContentType': content_type},
+            OutputDataConfig={'S3Uri': output_uri},
+            DataAccessRoleArn=self.role_arn,
+            SourceLanguageCode=src_lang_code,
+            TargetLanguageCodes=[dst_lang_code],
+        )
+
+        return response['JobId']
+
+    def job_status(self, job_id):
+        """One of SUBMITTED, IN_PROGRESS, COMPLETED, COMPLETED_WITH_ERROR, FAILED, STOP_REQUESTED or STOPPED."""
+        return self._describe(job_id)['JobStatus']
+
+    def output_uri(self, job_id):
+        """The s3:// folder with the results of a job."""
+        return self._describe(job_id)['OutputDataConfig']['S3Uri']
+
+    def _describe(self, job_id):
+        return self.client.describe_text_translation_job(JobId=job_id)['TextTranslationJobProperties']
+
+
+class Transcribe:
+    """Amazon Transcribe backend, see utils.fakes.FakeTranscribe for an offline stand-in."""
+
+    def __init__(self, region=None):
+        import boto3
+
+        self.region = region
+        self.client = boto3.client('transcribe', region_name=region.value if region else None)
+
+    def start_job(self, job_name, media_uri, language_code, media_format):
+        self.client.start_transcription_job(
+            TranscriptionJobName=job_name,
+            LanguageCode=language_code,
+            MediaFormat=media_format,
+            Media={"MediaFileUri": media_uri},
+        )
+
+        return job_name
+
+    def job_status(self, job_name):
+        job = self.client.get_transcription_job(TranscriptionJobName=job_name)
+        return job["TranscriptionJob"]["TranscriptionJobStatus"]
+
+    def get_transcript(self, job_name):
+        import requests
+
+        job = self.client.get_transcription_job(TranscriptionJobName=job_name)
+        transcript_uri = job["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
+        return requests.get(transcript_uri).text
+
+    def download_transcript(self, job_name, f, chunk_size=64 * 1024):
+        """Stream the transcript of a completed job into the binary file object f, without holding it in memory."""
+        import requests
+
+        job = self.client.get_transcription_job(TranscriptionJobName=job_name)
+        transcript_uri = job["TranscriptionJob"]["Transcript"]["TranscriptFileUri"]
+
+        with requests.get(transcript_uri, stream=True) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+
+
 class S3:
     origin = 'aws'
     default_folder = '/tmp'
 
     def __init__(self, region, bucket):
+        import boto3
+
         self.region = region
         self.bucket = bucket
-        self.s3_client = boto3.client('s3')
+        self.s3_client = boto3.client('s3', region_name=self.region.value)
 
     def upload(self, filepath, key):
         if not self.bucket_exists():
             self.create_bucket()
 
+        import boto3
+
         s3_resource = boto3.resource('s3', region_name=self.region.value)
         s3_bucket = s3_resource.Bucket(name=self.bucket)
-        s3_bucket.upload_file(Filename=filepath, Key=key)
+        with metrics.timer('s3_upload_seconds', mode='file'):
+            s3_bucket.upload_file(Filename=filepath, Key=key)
+        metrics.inc('s3_upload_bytes_total', os.path.getsize(filepath))
 
         return self.get_object_uri(key=key)
 
+    def upload_stream(self, fileobj, key):
+        """Upload a readable, possibly non-seekable, stream as a multipart upload.
+
+        Parts are sent as soon as they have been read, so the data never has to exist in full locally.
+        """
+        if not self.bucket_exists():
+            self.create_bucket()
+
+        import boto3
+
+        s3_resource = boto3.resource('s3', region_name=self.region.value)
+        s3_bucket = s3_resource.Bucket(name=self.bucket)
+        with metrics.timer('s3_upload_seconds', mode='stream'):
+            s3_bucket.upload_fileobj(
+                Fileobj=fileobj,
+                Key=key,
+                Callback=lambda num_bytes: metrics.inc('s3_upload_bytes_total', num_bytes),
+            )
+
+        return self.get_object_uri(key=key)
+
+    def get(self, key):
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        return response['Body'].read()
+
+    def s3_uri(self, key):
+        """The s3:// form of a key or prefix, as the Translate and Transcribe job APIs expect it."""
+        return f's3://{self.bucket}/{key}'
+
     def bucket_exists(self):
         """Check if a bucket exists."""
+        from botocore.exceptions import ClientError
+
         try:
             self.s3_client.head_bucket(Bucket=self.bucket)
             return True
@@ -53,10 +200,10 @@ class S3:
 
     def create_bucket(self):
         """Create an S3 bucket in a specified region."""
+        from botocore.exceptions import ClientError
+
         try:
-            location = {'LocationConstraint': self.region.value}
-            self.s3_client.create_bucket(Bucket=self.bucket,
-                                         CreateBucketConfiguration=location)
+            self.s3_client.create_bucket(Bucket=self.bucket, **bucket_configuration(self.region))
         except ClientError as e:
             print(f"Error creating bucket: {e}")
             raise e
@@ -70,8 +217,7 @@ class S3:
         Returns:
             dict: The response from the S3 service after attempting the delete operation.
         """
-        s3_client = boto3.client('s3')
-        response = s3_client.delete_object(Bucket=self.bucket, Key=key)
+        response = self.s3_client.delete_object(Bucket=self.bucket, Key=key)
         return response['ResponseMetadata']['HTTPStatusCode'] == 204
 
     def exists(self, key):
@@ -88,9 +234,9 @@ class S3:
         return True
 
     def get_object_uri(self, key):
-        object_location = boto3.client('s3').get_bucket_location(Bucket=self.bucket)['LocationConstraint']
-        object_uri = 'https://{bucket}.s3-{location}.amazonaws.com/{key}'.format(
-            location=object_location,
+        # The bucket is created in self.region, asking S3 for its location would answer None in us-east-1.
+        object_uri = 'https://{bucket}.s3.{location}.amazonaws.com/{key}'.format(
+            location=self.region.value,
             bucket=self.bucket,
             key=key
         )
@@ -99,10 +245,14 @@ class S3:
 
     def metadata(self, uri):
         bucket, region, key = re.search(
-            pattern=r'https://([^\.]+)\.s3-([^\.]+)\.amazonaws.com/(.+$)',
+            # Also the legacy s3-<region> hostnames of objects uploaded before.
+            pattern=r'https://([^\.]+)\.s3[\.-]([^\.]+)\.amazonaws.com/(.+$)',
             string=uri
         ).groups()
-        s3_client = boto3.client('s3')
+
+        import boto3
+
+        s3_client = boto3.client('s3', region_name=region)
         s3_object = s3_client.get_object(Bucket=bucket, Key=key)
 
         metadata = {
@@ -117,11 +267,23 @@ class S3:
 
         return metadata
 
-    def list_files(self):
-        resource_list = [obj.key for obj in self._list_objects()]
+    def list_files(self, prefix=''):
+        resource_list = [obj.key for obj in self._list_objects(prefix)]
         return resource_list
 
-    def _list_objects(self):
+    def _list_objects(self, prefix=''):
+        import boto3
+
         resource = boto3.resource('s3', region_name=self.region.value)
         bucket = resource.Bucket(name=self.bucket)
+        if prefix:
+            return bucket.objects.filter(Prefix=prefix)
         return bucket.objects.all()
+
+
+def bucket_configuration(region):
+    """The create_bucket arguments for region. us-east-1 is the default location and rejects a LocationConstraint."""
+    if region == Region.US_EAST_1:
+        return {}
+
+    return {'CreateBucketConfiguration': {'LocationConstraint': region.value}}
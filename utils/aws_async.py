@@ -0,0 +1,290 @@
+"""asyncio counterparts of the backends in utils.aws, on aiobotocore (and its aiohttp).
+
+All backends of an event loop share a ClientPool: one aiobotocore client per service and region, each
+with its own pool of connections, and one aiohttp session for plain downloads. Close it with
+close_client_pool() before the loop ends, or pass the backends a ClientPool used as an async context
+manager. Every backend also limits its own requests in flight with a semaphore, so a single loop can
+drive thousands of requests without exceeding a service quota. utils.fakes has AsyncFakeTranslate,
+AsyncFakeTranscribe and AsyncFakeS3 to run offline.
+"""
+import asyncio
+import contextlib
+import os
+import weakref
+
+import utils.aws as aws
+import utils.metrics as metrics
+
+MAX_CONNECTIONS = 100
+MAX_CONCURRENCY = 50
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+_pools = weakref.WeakKeyDictionary()
+
+
+class ClientPool:
+    """aiobotocore clients and an aiohttp session, created on first use and closed together.
+
+        async with ClientPool() as pool:
+            translator = AsyncTranslate(pool=pool)
+    """
+
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_attempts=10, endpoint_url=None):
+        self.max_connections = max_connections
+        self.max_attempts = max_attempts
+        # E.g. a LocalStack or moto server to run against instead of AWS.
+        self.endpoint_url = endpoint_url
+        self._clients = {}
+        self._http = None
+        self._stack = contextlib.AsyncExitStack()
+        self._lock = None
+
+    async def client(self, service, region=None):
+        key = (service, region)
+
+        if key not in self._clients:
+            async with self._get_lock():
+                if key not in self._clients:
+                    from aiobotocore.config import AioConfig
+                    from aiobotocore.session import get_session
+
+                    self._clients[key] = await self._stack.enter_async_context(get_session().create_client(
+                        service,
+                        region_name=region.value if region else None,
+                        endpoint_url=self.endpoint_url,
+                        config=AioConfig(
+                            max_pool_connections=self.max_connections,
+                            retries={'max_attempts': self.max_attempts},
+                        ),
+                    ))
+
+        return self._clients[key]
+
+    async def http(self):
+        if self._http is None:
+            async with self._get_lock():
+                if self._http is None:
+                    import aiohttp
+
+                    self._http = await self._stack.enter_async_context(
+                        aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+                    )
+
+        return self._http
+
+    async def aclose(self):
+        await self._stack.aclose()
+        self._clients = {}
+        self._http = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    def _get_lock(self):
+        # Created lazily, so it belongs to the loop that uses the pool.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+
+def client_pool():
+    """The ClientPool shared by the backends of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _pools:
+        _pools[loop] = ClientPool()
+
+    return _pools[loop]
+
+
+async def close_client_pool():
+    """Close the ClientPool of the running event loop, if it has one."""
+    pool = _pools.pop(asyncio.get_running_loop(), None)
+    if pool is not None:
+        await pool.aclose()
+
+
+class _AsyncBackend:
+    def __init__(self, region, pool=None, max_concurrency=MAX_CONCURRENCY):
+        self.region = region
+        self.pool = pool
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+
+    def _limit(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def _client(self, service):
+        return await (self.pool or client_pool()).client(service, self.region)
+
+
+class AsyncTranslate(_AsyncBackend):
+    """Amazon Translate with the interface of utils.aws.Translate, with coroutine methods."""
+
+    def __init__(self, region=aws.Region.EU_IRELAND, pool=None, max_concurrency=MAX_CONCURRENCY):
+        super().__init__(region, pool, max_concurrency)
+
+    async def translate_text(self, text, src_lang_code, dst_lang_code):
+        client = await self._client('translate')
+
+        async with self._limit():
+            return await client.translate_text(
+                Text=text,
+                SourceLanguageCode=src_lang_code,
+                TargetLanguageCode=dst_lang_code
+            )
+
+
+class AsyncTranscribe(_AsyncBackend):
+    """Amazon Transcribe with the interface of utils.aws.Transcribe, with coroutine methods."""
+
+    def __init__(self, region=None, pool=None, max_concurrency=MAX_CONCURRENCY):
+        super().__init__(region, pool, max_concurrency)
+
+    async def start_job(self, job_name, media_uri, language_code, media_format):
+        client = await self._client('transcribe')
+
+        async with self._limit():
+            await client.start_transcription_job(
+                TranscriptionJobName=job_name,
+                LanguageCode=language_code,
+                MediaFormat=media_format,
+                Media={"MediaFileUri": media_uri},
+            )
+
+        return job_name
+
+    async def job_status(self, job_name):
+        return (await self._job(job_name))["TranscriptionJobStatus"]
+
+    async def download_transcript(self, job_name, f, chunk_size=64 * 1024):
+        """Stream the transcript of a completed job into the binary file object f."""
+        transcript_uri = (await self._job(job_name))["Transcript"]["TranscriptFileUri"]
+        http = await (self.pool or client_pool()).http()
+
+        async with self._limit(), http.get(transcript_uri) as response:
+            response.raise_for_status()
+            async for chunk in response.content.iter_chunked(chunk_size):
+                f.write(chunk)
+
+    async def _job(self, job_name):
+        client = await self._client('transcribe')
+
+        async with self._limit():
+            job = await client.get_transcription_job(TranscriptionJobName=job_name)
+
+        return job["TranscriptionJob"]
+
+
+class AsyncS3(_AsyncBackend):
+    """The S3 operations of utils.aws.S3 that transcription needs, with coroutine methods.
+
+    Files larger than MULTIPART_CHUNK_SIZE are uploaded in parts, so at most one part per upload is in
+    memory.
+    """
+    origin = 'aws'
+
+    def __init__(self, region, bucket, pool=None, max_concurrency=MAX_CONCURRENCY):
+        super().__init__(region, pool, max_concurrency)
+        self.bucket = bucket
+
+    async def upload(self, filepath, key):
+        if not await self.bucket_exists():
+            await self.create_bucket()
+
+        client = await self._client('s3')
+        size = os.path.getsize(filepath)
+
+        # The file is read in worker threads, so the event loop never waits for the disk.
+        async with self._limit():
+            with metrics.timer('s3_upload_seconds', mode='async'), open(filepath, 'rb') as f:
+                if size <= MULTIPART_CHUNK_SIZE:
+                    await client.put_object(Bucket=self.bucket, Key=key, Body=await asyncio.to_thread(f.read))
+                else:
+                    await self._upload_parts(client, f, key)
+        metrics.inc('s3_upload_bytes_total', size)
+
+        return await self.get_object_uri(key=key)
+
+    async def get(self, key):
+        client = await self._client('s3')
+
+        async with self._limit():
+            response = await client.get_object(Bucket=self.bucket, Key=key)
+            async with response['Body'] as body:
+                return await body.read()
+
+    async def bucket_exists(self):
+        from botocore.exceptions import ClientError
+
+        client = await self._client('s3')
+        try:
+            async with self._limit():
+                await client.head_bucket(Bucket=self.bucket)
+            return True
+        except ClientError:
+            return False
+
+    async def create_bucket(self):
+        client = await self._client('s3')
+
+        async with self._limit():
+            await client.create_bucket(Bucket=self.bucket, **aws.bucket_configuration(self.region))
+
+    async def delete(self, key):
+        client = await self._client('s3')
+
+        async with self._limit():
+            response = await client.delete_object(Bucket=self.bucket, Key=key)
+
+        return response['ResponseMetadata']['HTTPStatusCode'] == 204
+
+    async def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        client = await self._client('s3')
+        try:
+            async with self._limit():
+                await client.head_object(Bucket=self.bucket, Key=key)
+            return True
+        except ClientError:
+            return False
+
+    async def get_object_uri(self, key):
+        return f'https://{self.bucket}.s3.{self.region.value}.amazonaws.com/{key}'
+
+    async def list_files(self, prefix=''):
+        client = await self._client('s3')
+        keys = []
+
+        async with self._limit():
+            async for page in client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=prefix):
+                keys.extend(obj['Key'] for obj in page.get('Contents', []))
+
+        return keys
+
+    async def _upload_parts(self, client, f, key):
+        upload_id = (await client.create_multipart_upload(Bucket=self.bucket, Key=key))['UploadId']
+        parts = []
+
+        try:
+            for number in range(1, 10001):
+                chunk = await asyncio.to_thread(f.read, MULTIPART_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                response = await client.upload_part(
+                    Bucket=self.bucket, Key=key, PartNumber=number, UploadId=upload_id, Body=chunk
+                )
+                parts.append({'ETag': response['ETag'], 'PartNumber': number})
+
+            await client.complete_multipart_upload(
+                Bucket=self.bucket, Key=key, UploadId=upload_id, MultipartUpload={'Parts': parts}
+            )
+        except BaseException:
+            await client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            raise
@@ -0,0 +1,53 @@
+"""Transparent gzip storage for transcripts and intermediate artifacts.
+
+Writers decide whether to compress, readers recognise gzip by its magic bytes and accept both forms, so
+files written before compression was enabled keep working.
+"""
+import gzip
+import os
+
+GZIP_MAGIC = b'\x1f\x8b'
+GZIP_SUFFIX = '.gz'
+COMPRESS_LEVEL = 6
+
+
+def is_compressed(path):
+    with open(path, 'rb') as f:
+        return f.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def open_text(path, mode='r'):
+    """Open a text file for reading, compressed or not, or for writing, compressed when path ends in .gz."""
+    if 'r' in mode:
+        if is_compressed(path):
+            return gzip.open(path, 'rt', encoding='utf-8')
+        return open(path, 'r', encoding='utf-8')
+
+    if str(path).endswith(GZIP_SUFFIX):
+        return gzip.open(path, 'wt', encoding='utf-8', compresslevel=COMPRESS_LEVEL)
+    return open(path, mode, encoding='utf-8')
+
+
+def open_binary_writer(path):
+    """Open path for writing bytes, compressed when it ends in .gz."""
+    if str(path).endswith(GZIP_SUFFIX):
+        return gzip.open(path, 'wb', compresslevel=COMPRESS_LEVEL)
+    return open(path, 'wb')
+
+
+def compress(data):
+    # A fixed mtime keeps the output deterministic for equal input.
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+def decompress(data):
+    """Return data uncompressed, whether it was compressed or not."""
+    if data[:len(GZIP_MAGIC)] == GZIP_MAGIC:
+        return gzip.decompress(data)
+    return data
+
+
+def strip_suffix(path):
+    """The path without its .gz suffix, e.g. to derive the name of a file made from it."""
+    path = os.fspath(path)
+    return path[:-len(GZIP_SUFFIX)] if path.endswith(GZIP_SUFFIX) else path
@@ -0,0 +1,444 @@
+"""In-process stand-ins for the AWS backends in utils.aws, for load tests and benchmarks without network.
+
+The fakes expose the same methods as utils.aws.Translate, utils.aws.BatchTranslate, utils.aws.Transcribe
+and utils.aws.S3, and can be passed wherever those are accepted. The Async* fakes do the same for the
+coroutine backends in utils.aws_async. Latency and throttling are drawn from seeded random generators,
+0 unless another seed is passed, so a run with the same seeds and the same call order is reproducible.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import string
+import threading
+import time
+import uuid
+
+PSEUDO_WORDS = (
+    'the', 'a', 'we', 'subtitle', 'shop', 'video', 'audio', 'transcription', 'test', 'people', 'talk',
+    'about', 'many', 'things', 'today', 'and', 'then', 'quickly', 'explain', 'how', 'to', 'pass', 'it',
+)
+
+
+class LatencyModel:
+    """Random latency in seconds.
+
+    Args:
+        mean (float): Mean latency.
+        stddev (float): Spread around the mean, ignored for the 'constant' and 'exponential' distributions.
+        distribution (str): One of 'constant', 'normal', 'lognormal' or 'exponential'.
+        seed (int): Seed of the random generator, None for a different sequence on every run.
+    """
+
+    def __init__(self, mean=0.0, stddev=0.0, distribution='normal', seed=0):
+        self.mean = mean
+        self.stddev = stddev
+        self.distribution = distribution
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self):
+        if self.mean <= 0:
+            return 0.0
+
+        with self._lock:
+            if self.distribution == 'constant':
+                return self.mean
+            if self.distribution == 'normal':
+                return max(0.0, self._random.gauss(self.mean, self.stddev))
+            if self.distribution == 'lognormal':
+                # Parametrised so the distribution has the requested mean and standard deviation.
+                sigma_squared = math.log(1 + (self.stddev / self.mean) ** 2)
+                mu = math.log(self.mean) - sigma_squared / 2
+                return self._random.lognormvariate(mu, math.sqrt(sigma_squared))
+            if self.distribution == 'exponential':
+                return self._random.expovariate(1 / self.mean)
+
+        raise ValueError(f'Unknown latency distribution: {self.distribution}')
+
+    def sleep(self):
+        seconds = self.sample()
+        if seconds:
+            time.sleep(seconds)
+
+        return seconds
+
+
+class _Throttle:
+    def __init__(self, rate, seed, operation):
+        self.rate = rate
+        self.operation = operation
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def check(self):
+        if not self.rate:
+            return
+
+        with self._lock:
+            throttled = self._random.random() < self.rate
+
+        if throttled:
+            from botocore.exceptions import ClientError
+
+            raise ClientError(
+                {'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded (fake)'}},
+                self.operation
+            )
+
+
+class FakeTranslate:
+    """Deterministic pseudo-translation with configurable latency and throttling.
+
+    Every word is mapped letter by letter through an alphabet shuffled by the target language, so the
+    same source word always yields the same target word. Full-text and per-block translations of a
+    page are therefore consistent, which is what the sync step relies on.
+    """
+
+    def __init__(self, latency=None, throttle_rate=0.0, seed=0):
+        self.latency = latency or LatencyModel()
+        self._throttle = _Throttle(throttle_rate, seed, 'TranslateText')
+        self.calls = 0
+        self.throttled = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def translate_text(self, text, src_lang_code, dst_lang_code):
+        self._count(text)
+        self.latency.sleep()
+
+        return self._respond(text, src_lang_code, dst_lang_code)
+
+    def _count(self, text):
+        with self._lock:
+            self.calls += 1
+            self.bytes += len(text.encode('utf-8'))
+
+    def _respond(self, text, src_lang_code, dst_lang_code):
+        try:
+            self._throttle.check()
+        except Exception:
+            with self._lock:
+                self.throttled += 1
+            raise
+
+        return {
+            'TranslatedText': pseudo_translate(text, dst_lang_code),
+            'SourceLanguageCode': src_lang_code,
+            'TargetLanguageCode': dst_lang_code,
+        }
+
+
+class AsyncFakeTranslate(FakeTranslate):
+    """FakeTranslate with the coroutine interface of utils.aws_async.AsyncTranslate, latency is awaited."""
+
+    async def translate_text(self, text, src_lang_code, dst_lang_code):
+        import asyncio
+
+        self._count(text)
+        await asyncio.sleep(self.latency.sample())
+
+        return self._respond(text, src_lang_code, dst_lang_code)
+
+
+class FakeTranscribe:
+    """Transcription jobs that are queued and run for a random time, then yield a synthetic transcript."""
+
+    def __init__(self, queue_latency=None, run_latency=None, throttle_rate=0.0, words_per_job=1000, seed=0):
+        self.queue_latency = queue_latency or LatencyModel()
+        self.run_latency = run_latency or LatencyModel()
+        self.words_per_job = words_per_job
+        self.seed = seed
+        self._throttle = _Throttle(throttle_rate, seed, 'StartTranscriptionJob')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def start_job(self, job_name, media_uri, language_code, media_format):
+        self._throttle.check()
+
+        now = time.monotonic()
+        started_at = now + self.queue_latency.sample()
+        with self._lock:
+            self._jobs[job_name] = {
+                'media_uri': media_uri,
+                'started_at': started_at,
+                'finished_at': started_at + self.run_latency.sample(),
+            }
+
+        return job_name
+
+    def job_status(self, job_name):
+        job = self._jobs[job_name]
+        now = time.monotonic()
+
+        if now < job['started_at']:
+            return 'QUEUED'
+        if now < job['finished_at']:
+            return 'IN_PROGRESS'
+
+        return 'COMPLETED'
+
+    def get_transcript(self, job_name):
+        media_uri = self._jobs[job_name]['media_uri']
+        seed = int(hashlib.sha256(f'{self.seed}:{media_uri}'.encode('utf-8')).hexdigest()[:8], 16)
+
+        return synthetic_transcript(self.words_per_job, seed=seed)
+
+    def download_transcript(self, job_name, f, chunk_size=64 * 1024):
+        data = self.get_transcript(job_name).encode('utf-8')
+        for i in range(0, len(data), chunk_size):
+            f.write(data[i:i + chunk_size])
+
+
+class AsyncFakeTranscribe(FakeTranscribe):
+    """FakeTranscribe with the coroutine interface of utils.aws_async.AsyncTranscribe."""
+
+    async def start_job(self, job_name, media_uri, language_code, media_format):
+        return super().start_job(job_name, media_uri, language_code, media_format)
+
+    async def job_status(self, job_name):
+        return super().job_status(job_name)
+
+    async def download_transcript(self, job_name, f, chunk_size=64 * 1024):
+        super().download_transcript(job_name, f, chunk_size)
+
+
+class FakeS3:
+    """In-memory bucket with the interface of utils.aws.S3.
+
+    Uploads take the sampled latency plus the time needed at bandwidth bytes per second.
+    """
+    origin = 'fake'
+
+    def __init__(self, region, bucket, latency=None, bandwidth=None, throttle_rate=0.0, seed=0):
+        self.region = region
+        self.bucket = bucket
+        self.latency = latency or LatencyModel()
+        self.bandwidth = bandwidth
+        self._throttle = _Throttle(throttle_rate, seed, 'PutObject')
+        self.objects = {}
+        self._bucket_exists = False
+        self._lock = threading.Lock()
+
+    def upload(self, filepath, key):
+        with open(filepath, 'rb') as f:
+            return self.upload_stream(f, key)
+
+    def upload_stream(self, fileobj, key):
+        if not self.bucket_exists():
+            self.create_bucket()
+
+        self._throttle.check()
+        self.latency.sleep()
+
+        data = fileobj.read()
+        if self.bandwidth:
+            time.sleep(len(data) / self.bandwidth)
+
+        with self._lock:
+            self.objects[key] = data
+
+        return self.get_object_uri(key=key)
+
+    def bucket_exists(self):
+        return self._bucket_exists
+
+    def create_bucket(self):
+        self._bucket_exists = True
+
+    def delete(self, key):
+        with self._lock:
+            return self.objects.pop(key, None) is not None
+
+    def exists(self, key):
+        return any(key in stored_key for stored_key in self.list_files())
+
+    def get_object_uri(self, key):
+        return f'https://{self.bucket}.s3.{self.region.value}.amazonaws.com/{key}'
+
+    def get(self, key):
+        return self.objects[key]
+
+    def s3_uri(self, key):
+        return f's3://{self.bucket}/{key}'
+
+    def metadata(self, uri):
+        key = uri.split('.amazonaws.com/', 1)[1]
+        data = self.objects[key]
+
+        return {
+            'uri': uri,
+            'bucket': self.bucket,
+            'region': self.region.value,
+            'key': key,
+            'origin': self.origin,
+            'content_length': len(data),
+            'e_tag': hashlib.md5(data).hexdigest(),
+        }
+
+    def list_files(self, prefix=''):
+        with self._lock:
+            return [key for key in self.objects if key.startswith(prefix)]
+
+
+class AsyncFakeS3(FakeS3):
+    """FakeS3 with the coroutine interface of utils.aws_async.AsyncS3, latency and transfer time are awaited."""
+
+    async def upload(self, filepath, key):
+        import asyncio
+
+        if not self.bucket_exists():
+            self.create_bucket()
+
+        self._throttle.check()
+        await asyncio.sleep(self.latency.sample())
+
+        with open(filepath, 'rb') as f:
+            data = f.read()
+        if self.bandwidth:
+            await asyncio.sleep(len(data) / self.bandwidth)
+
+        with self._lock:
+            self.objects[key] = data
+
+        return super().get_object_uri(key=key)
+
+    async def get(self, key):
+        return super().get(key)
+
+    async def delete(self, key):
+        return super().delete(key)
+
+    async def exists(self, key):
+        return any(key in stored_key for stored_key in super().list_files())
+
+    async def get_object_uri(self, key):
+        return super().get_object_uri(key)
+
+    async def list_files(self, prefix=''):
+        return super().list_files(prefix)
+
+
+class FakeBatchTranslate:
+    """Batch translation jobs over the documents in a FakeS3 bucket, with the interface of utils.aws.BatchTranslate.
+
+    Documents are pseudo-translated like FakeTranslate does, leaving HTML tags and entities intact. The
+    results are written to the bucket when a job is first seen completed.
+    """
+
+    def __init__(self, s3, queue_latency=None, run_latency=None, throttle_rate=0.0, seed=0):
+        self.s3 = s3
+        self.queue_latency = queue_latency or LatencyModel()
+        self.run_latency = run_latency or LatencyModel()
+        self._throttle = _Throttle(throttle_rate, seed, 'StartTextTranslationJob')
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    def start_job(self, job_name, input_uri, output_uri, src_lang_code, dst_lang_code, content_type='text/html'):
+        self._throttle.check()
+
+        job_id = uuid.uuid4().hex
+        started_at = time.monotonic() + self.queue_latency.sample()
+        with self._lock:
+            self.jobs[job_id] = {
+                'input_key': self._key(input_uri),
+                'output_key': f'{self._key(output_uri)}fake-TranslateText-{job_id}/',
+                'dst_lang_code': dst_lang_code,
+                'started_at': started_at,
+                'finished_at': started_at + self.run_latency.sample(),
+                'written': False,
+            }
+
+        return job_id
+
+    def job_status(self, job_id):
+        job = self.jobs[job_id]
+        now = time.monotonic()
+
+        if now < job['started_at']:
+            return 'SUBMITTED'
+        if now < job['finished_at']:
+            return 'IN_PROGRESS'
+
+        with self._lock:
+            if not job['written']:
+                self._write_results(job)
+                job['written'] = True
+
+        return 'COMPLETED'
+
+    def output_uri(self, job_id):
+        return self.s3.s3_uri(self.jobs[job_id]['output_key'])
+
+    def _write_results(self, job):
+        for key in self.s3.list_files(prefix=job['input_key']):
+            text = self.s3.get(key).decode('utf-8')
+            # Only the text between tags and entities is translated.
+            translated = ''.join(
+                part if part.startswith(('<', '&')) else pseudo_translate(part, job['dst_lang_code'])
+                for part in re.split(r'(<[^>]*>|&#?\w+;)', text)
+            )
+            name = key.rsplit('/', 1)[-1]
+            self.s3.objects[f'{job["output_key"]}{job["dst_lang_code"]}.{name}'] = translated.encode('utf-8')
+
+    def _key(self, uri):
+        return uri.split(f's3://{self.s3.bucket}/', 1)[1]
+
+
+def pseudo_translate(text, dst_lang_code):
+    """Deterministically 'translate' text by substituting letters, keeping spaces, newlines and punctuation."""
+    return text.translate(_translation_table(dst_lang_code))
+
+
+_tables = {}
+
+
+def _translation_table(dst_lang_code):
+    table = _tables.get(dst_lang_code)
+
+    if table is None:
+        letters = list(string.ascii_lowercase)
+        random.Random(dst_lang_code).shuffle(letters)
+        shuffled = ''.join(letters)
+        table = str.maketrans(
+            string.ascii_lowercase + string.ascii_uppercase,
+            shuffled + shuffled.upper()
+        )
+        _tables[dst_lang_code] = table
+
+    return table
+
+
+def synthetic_transcript(num_words, seed=0, words_per_sentence=12, seconds_per_word=0.35):
+    """Generate an Amazon Transcribe style JSON transcript of num_words words."""
+    rng = random.Random(seed)
+    items = []
+    words = []
+    start_time = 0.0
+
+    for i in range(num_words):
+        word = rng.choice(PSEUDO_WORDS)
+        words.append(word)
+        end_time = start_time + seconds_per_word * 0.85
+        items.append({
+            'type': 'pronunciation',
+            'start_time': f'{start_time:.3f}',
+            'end_time': f'{end_time:.3f}',
+            'alternatives': [{'confidence': f'{rng.uniform(0.8, 1.0):.4f}', 'content': word}],
+        })
+        start_time += seconds_per_word
+
+        if i % words_per_sentence == words_per_sentence - 1:
+            items.append({'type': 'punctuation', 'alternatives': [{'confidence': '0.0', 'content': '.'}]})
+            # A pause between sentences
+            start_time += seconds_per_word * rng.randint(0, 3)
+
+    return json.dumps({
+        'jobName': f'fake_{uuid.UUID(int=rng.getrandbits(128)).hex}',
+        'results': {
+            'transcripts': [{'transcript': ' '.join(words)}],
+            'items': items,
+        },
+        'status': 'COMPLETED',
+    })
@@ -0,0 +1,183 @@
+"""Lightweight counters, timers and histograms for the pipeline.
+
+Metrics are disabled by default and every call returns immediately, so instrumented hot paths cost a
+function call at most. Enable them with metrics.enable() or by setting SUBTITLE_SHOP_METRICS=1.
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+COUNT_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, float('inf'))
+
+_enabled = os.environ.get('SUBTITLE_SHOP_METRICS', '') not in ('', '0')
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _Timer:
+    def __init__(self, name, buckets, labels):
+        self.name = name
+        self.buckets = buckets
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        observe(self.name, self.seconds, buckets=self.buckets, **self.labels)
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name, value=1, **labels):
+    if not _enabled:
+        return
+
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, buckets=DEFAULT_BUCKETS, **labels):
+    if not _enabled:
+        return
+
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {'buckets': buckets, 'counts': [0] * len(buckets), 'count': 0, 'sum': 0.0}
+
+        histogram['count'] += 1
+        histogram['sum'] += value
+        for i, upper_bound in enumerate(histogram['buckets']):
+            if value <= upper_bound:
+                histogram['counts'][i] += 1
+                break
+
+
+def timer(name, buckets=DEFAULT_BUCKETS, **labels):
+    """Context manager observing the elapsed seconds of its block in the histogram name."""
+    if not _enabled:
+        return _NULL_TIMER
+
+    return _Timer(name, buckets, labels)
+
+
+def snapshot():
+    with _lock:
+        counters = [
+            {'name': name, 'labels': dict(labels), 'value': value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+        histograms = [
+            {
+                'name': name,
+                'labels': dict(labels),
+                'count': histogram['count'],
+                'sum': histogram['sum'],
+                'buckets': [
+                    {'le': upper_bound, 'count': count}
+                    for upper_bound, count in zip(histogram['buckets'], histogram['counts'])
+                ],
+            }
+            for (name, labels), histogram in sorted(_histograms.items())
+        ]
+
+    return {'counters': counters, 'histograms': histograms}
+
+
+def to_json(indent=2):
+    data = snapshot()
+    for histogram in data['histograms']:
+        for bucket in histogram['buckets']:
+            bucket['le'] = _format_bound(bucket['le'])
+
+    return json.dumps(data, indent=indent)
+
+
+def to_prometheus():
+    """Render all metrics in the Prometheus text exposition format."""
+    data = snapshot()
+    lines = []
+
+    seen = set()
+    for counter in data['counters']:
+        if counter['name'] not in seen:
+            lines.append(f'# TYPE {counter["name"]} counter')
+            seen.add(counter['name'])
+        lines.append(f'{counter["name"]}{_format_labels(counter["labels"])} {counter["value"]}')
+
+    for histogram in data['histograms']:
+        name = histogram['name']
+        if name not in seen:
+            lines.append(f'# TYPE {name} histogram')
+            seen.add(name)
+
+        cumulative = 0
+        for bucket in histogram['buckets']:
+            cumulative += bucket['count']
+            labels = dict(histogram['labels'], le=_format_bound(bucket['le']))
+            lines.append(f'{name}_bucket{_format_labels(labels)} {cumulative}')
+        lines.append(f'{name}_sum{_format_labels(histogram["labels"])} {histogram["sum"]}')
+        lines.append(f'{name}_count{_format_labels(histogram["labels"])} {histogram["count"]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def write(path):
+    """Export to path, as Prometheus text for a .prom file and as JSON otherwise."""
+    content = to_prometheus() if path.endswith('.prom') else to_json()
+    with open(path, 'w') as f:
+        f.write(content)
+
+    return path
+
+
+def _format_bound(upper_bound):
+    return '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in sorted(labels.items())) + '}'
@@ -0,0 +1,145 @@
+"""MinHash signatures of character shingles, used by subtitle.sync_minhash to shortlist block boundaries.
+
+The shingles are the same character k-grams strsimpy's Jaccard(k) uses, so the fraction of equal
+signature entries estimates 1 - algorithm.jaccard. Signatures of a growing span of words are built
+incrementally: appending a word only adds the shingles that touch it, and the signature of the longer
+span is the element-wise minimum of the shorter one and those of the new shingles.
+"""
+import re
+import zlib
+
+SHINGLE_SIZE = 3
+MAX_HASH = (1 << 32) - 1
+
+_hash_functions = {}
+
+
+def shingles(text, k=SHINGLE_SIZE):
+    text = re.sub(r'\s+', ' ', text)
+    return {text[i:i + k] for i in range(len(text) - k + 1)}
+
+
+def hash_functions(num_perm, seed=1):
+    """Parameters (a, b) of num_perm multiply-shift hash functions, cached per size and seed."""
+    import numpy as np
+
+    key = (num_perm, seed)
+    if key not in _hash_functions:
+        rng = np.random.RandomState(seed)
+        a = rng.randint(1, 1 << 62, size=num_perm, dtype=np.uint64) | np.uint64(1)   # Must be odd
+        b = rng.randint(0, 1 << 62, size=num_perm, dtype=np.uint64)
+        _hash_functions[key] = (a, b)
+
+    return _hash_functions[key]
+
+
+def signature(shingle_set, num_perm, seed=1):
+    """MinHash signature of a set of shingles, an array of num_perm 32-bit values."""
+    import numpy as np
+
+    a, b = hash_functions(num_perm, seed)
+    if not shingle_set:
+        return np.full(num_perm, MAX_HASH, dtype=np.uint64)
+
+    values = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingle_set), dtype=np.uint64)
+    # Wrapping uint64 arithmetic, the high 32 bits of a * x + b are a universal hash of x.
+    hashed = (values[:, None] * a[None, :] + b[None, :]) >> np.uint64(32)
+
+    return hashed.min(axis=0)
+
+
+class WordShingles:
+    """Shingles and MinHash minima of every word of a text, as it appears in ' '.join(words).
+
+    Hashing is done once for the whole text, signatures of any span are then a cumulative minimum.
+    """
+
+    def __init__(self, words, num_perm, seed=1, k=SHINGLE_SIZE):
+        import numpy as np
+
+        self.words = words
+        self.num_perm = num_perm
+        self.seed = seed
+        self.k = k
+
+        # Per word, the k - 1 characters before it and the shingles it adds to the text before it.
+        self.tails = []
+        self.added = []
+        tail = ''
+        for n, word in enumerate(words):
+            self.tails.append(tail)
+            self.added.append(self._added_shingles(tail, word, first=n == 0))
+            tail = (f'{tail} {word}' if n > 0 else word)[-(k - 1):]
+
+        a, b = hash_functions(num_perm, seed)
+        counts = np.array([len(added) for added in self.added], dtype=np.int64)
+        self.minima = np.full((len(words), num_perm), MAX_HASH, dtype=np.uint64)
+
+        if counts.sum():
+            values = np.fromiter(
+                (zlib.crc32(shingle.encode('utf-8')) for added in self.added for shingle in added),
+                dtype=np.uint64
+            )
+            # Wrapping uint64 arithmetic, the high 32 bits of a * x + b are a universal hash of x.
+            hashed = (values[:, None] * a[None, :] + b[None, :]) >> np.uint64(32)
+
+            has_shingles = counts > 0
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[has_shingles]
+            self.minima[has_shingles] = np.minimum.reduceat(hashed, starts, axis=0)
+
+    def spans(self, start, length):
+        """Signatures of the spans words[start:start + n] for n from 1 to length.
+
+        Returns:
+            tuple: A (length, num_perm) array of signatures, and per word the set of shingles it added.
+        """
+        import numpy as np
+
+        minima = self.minima[start:start + length].copy()
+        added = self.added[start:start + length]
+
+        # The first words of a span lack the characters before them, redo them until the tails agree.
+        tail = ''
+        for n in range(length):
+            if tail == self.tails[start + n] and n > 0:
+                break
+
+            word = self.words[start + n]
+            added[n] = self._added_shingles(tail, word, first=n == 0)
+            minima[n] = signature(added[n], self.num_perm, self.seed)
+            tail = (f'{tail} {word}' if n > 0 else word)[-(self.k - 1):]
+
+        return np.minimum.accumulate(minima, axis=0), added
+
+    def _added_shingles(self, tail, word, first):
+        return shingles(word if first else f'{tail} {word}', self.k)
+
+
+def jaccard_distance(shingles_a, shingles_b):
+    """Exact Jaccard distance of two shingle sets, as algorithm.jaccard computes it for their texts."""
+    union = len(shingles_a | shingles_b)
+    if not union:
+        return 0.0
+
+    return 1.0 - len(shingles_a & shingles_b) / union
+
+
+def estimated_similarity(signatures, query):
+    """Estimated Jaccard similarity of every row of signatures with the query signature."""
+    return (signatures == query[None, :]).mean(axis=1)
+
+
+def lsh_candidates(signatures, query, bands):
+    """Indices of the rows sharing at least one band with the query, as an LSH index lookup would return.
+
+    The signatures are split in bands of num_perm / bands rows; two signatures collide in a band when
+    all its rows are equal. More bands means more (and less similar) candidates.
+    """
+    import numpy as np
+
+    num_spans, num_perm = signatures.shape
+    rows = num_perm // bands
+    span_bands = signatures[:, :rows * bands].reshape(num_spans, bands, rows)
+    query_bands = query[:rows * bands].reshape(1, bands, rows)
+
+    return np.nonzero((span_bands == query_bands).all(axis=2).any(axis=1))[0]
@@ -0,0 +1,207 @@
+"""Spreading Translate and Transcribe traffic over several AWS regions.
+
+A RegionRouter hands out regions within per-region quotas on requests in flight and requests per
+second. Among the regions with room it prefers the one with the lowest expected wait: the observed
+latency, scaled by the requests already in flight there. A region that throttles is skipped for a
+cool-down that doubles with every consecutive throttle, and requests fail over to the other regions.
+
+Routing is opt-in: without a router every call goes to the single default region of its module. Pass
+RoutedTranslate as translator and a router to transcribe, run_batch or the service's Backends (the
+service's --translate-regions and --transcribe-regions options) to spread the traffic.
+"""
+import threading
+import time
+
+import utils.aws as aws
+import utils.metrics as metrics
+
+THROTTLING_CODES = (
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'LimitExceededException',
+    'ProvisionedThroughputExceededException',
+    'RequestLimitExceeded',
+    'SlowDown',
+)
+
+
+class RegionQuota:
+    """Limits of one region: requests in flight, and requests per second (None for no limit)."""
+
+    def __init__(self, max_concurrency=10, max_per_second=None):
+        self.max_concurrency = max_concurrency
+        self.max_per_second = max_per_second
+
+
+class RegionRouter:
+    """Choose regions for requests within their quotas, preferring fast regions and avoiding throttled ones.
+
+    Args:
+        regions (list): The utils.aws.Region members to route to.
+        quotas (dict): RegionQuota per region, regions without one get default_quota.
+        cooldown (float): Seconds a region is skipped after it throttled, doubled per consecutive throttle.
+        max_cooldown (float): Upper bound of the cool-down.
+        latency_decay (float): Weight of a new latency observation in the moving average.
+    """
+
+    def __init__(self, regions, quotas=None, default_quota=None, cooldown=5.0, max_cooldown=300.0,
+                 latency_decay=0.2):
+        if not regions:
+            raise ValueError('A RegionRouter needs at least one region')
+
+        self.regions = list(regions)
+        self.quotas = {region: (quotas or {}).get(region, default_quota or RegionQuota()) for region in self.regions}
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.latency_decay = latency_decay
+
+        self._in_flight = {region: 0 for region in self.regions}
+        self._latency = {region: None for region in self.regions}
+        self._throttles = {region: 0 for region in self.regions}
+        self._cooling_until = {region: 0.0 for region in self.regions}
+        # Token bucket per region for max_per_second, starting full.
+        self._tokens = {region: float(self.quotas[region].max_per_second or 0) for region in self.regions}
+        self._refilled = {region: time.monotonic() for region in self.regions}
+        self._changed = threading.Condition()
+
+    def acquire(self, exclude=(), timeout=None):
+        """Reserve a slot in the best region with room, waiting for one when all are full or cooling down.
+
+        Regions in exclude, e.g. the ones a request already failed in, are only used when no other region is
+        configured. Returns the region, or None when timeout passed first.
+        """
+        candidates = [region for region in self.regions if region not in exclude] or self.regions
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        with self._changed:
+            while True:
+                now = time.monotonic()
+                available = [region for region in candidates if self._has_room(region, now)]
+
+                if available:
+                    region = min(available, key=self._expected_wait)
+                    self._in_flight[region] += 1
+                    if self.quotas[region].max_per_second:
+                        self._tokens[region] -= 1
+                    metrics.inc('region_requests_total', region=region.value)
+                    return region
+
+                wait = min(self._next_room(region, now) for region in candidates)
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = min(wait, deadline - now)
+
+                self._changed.wait(wait)
+
+    def release(self, region, seconds=None, throttled=False):
+        """Free the slot of a request, with its latency when it completed, or throttled when the region refused it.
+
+        Only a completed request ends a run of throttles, a request that failed otherwise leaves it as it is.
+        """
+        with self._changed:
+            self._in_flight[region] -= 1
+
+            if throttled:
+                self._throttles[region] += 1
+                cooldown = min(self.cooldown * 2 ** (self._throttles[region] - 1), self.max_cooldown)
+                self._cooling_until[region] = time.monotonic() + cooldown
+                metrics.inc('region_throttled_total', region=region.value)
+            elif seconds is not None:
+                self._throttles[region] = 0
+
+            if seconds is not None:
+                previous = self._latency[region]
+                self._latency[region] = seconds if previous is None else \
+                    (1 - self.latency_decay) * previous + self.latency_decay * seconds
+                metrics.observe('region_request_seconds', seconds, region=region.value)
+
+            self._changed.notify_all()
+
+    def status(self):
+        """Per region value: requests in flight, average latency and whether it is cooling down."""
+        now = time.monotonic()
+        with self._changed:
+            return {
+                region.value: {
+                    'in_flight': self._in_flight[region],
+                    'latency': self._latency[region],
+                    'cooling_down': self._cooling_until[region] > now,
+                }
+                for region in self.regions
+            }
+
+    def _has_room(self, region, now):
+        quota = self.quotas[region]
+
+        if self._cooling_until[region] > now or self._in_flight[region] >= quota.max_concurrency:
+            return False
+
+        if quota.max_per_second:
+            elapsed = now - self._refilled[region]
+            self._tokens[region] = min(quota.max_per_second, self._tokens[region] + elapsed * quota.max_per_second)
+            self._refilled[region] = now
+            return self._tokens[region] >= 1
+
+        return True
+
+    def _next_room(self, region, now):
+        """Upper bound of the time until the region may have room, a release notifies earlier."""
+        if self._cooling_until[region] > now:
+            return self._cooling_until[region] - now
+
+        quota = self.quotas[region]
+        if quota.max_per_second and self._tokens[region] < 1:
+            return (1 - self._tokens[region]) / quota.max_per_second
+
+        return 1.0
+
+    def _expected_wait(self, region):
+        # Regions without observations are tried first, so every region gets measured.
+        latency = self._latency[region] or 0.0
+        return latency * (self._in_flight[region] + 1)
+
+
+def is_throttling(error):
+    """Whether an exception is an AWS throttling error (a botocore ClientError with a throttling code)."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') in THROTTLING_CODES
+
+
+class RoutedTranslate:
+    """A translator with the interface of utils.aws.Translate that spreads calls over a RegionRouter.
+
+    A call that is throttled is retried in another region; when every region throttled it, the error is
+    raised, and translate.get_translation backs off as it does for a single region.
+    """
+
+    def __init__(self, router, translator_factory=None):
+        self.router = router
+        self.translator_factory = translator_factory or (lambda region: aws.Translate(region=region))
+        self._translators = {}
+        self._lock = threading.Lock()
+
+    def translate_text(self, text, src_lang_code, dst_lang_code):
+        tried = set()
+
+        while True:
+            region = self.router.acquire(exclude=tried)
+            start = time.perf_counter()
+            try:
+                response = self._translator(region).translate_text(text, src_lang_code, dst_lang_code)
+            except Exception as e:
+                self.router.release(region, throttled=is_throttling(e))
+                tried.add(region)
+                if not is_throttling(e) or len(tried) == len(self.router.regions):
+                    raise
+                continue
+
+            self.router.release(region, seconds=time.perf_counter() - start)
+            return response
+
+    def _translator(self, region):
+        with self._lock:
+            if region not in self._translators:
+                self._translators[region] = self.translator_factory(region)
+
+            return self._translators[region]
@@ -28,15 +28,21 @@
 
 from datetime import datetime, timedelta
 import json
-import boto3
 import re
 import codecs
 
+import utils.metrics as metrics
+
 # from audioUtils import *
 
 
 MAX_LINE_LENGTH = 42
 MAX_PAUSE_MS = 500
+# Amazon Translate accepts at most 10,000 bytes per request, stay well below it as subtitle.main does.
+MAX_TRANSLATE_BYTES = 4500
+# Speaking rate used to time a translation when there are no source phrases to take the timing from.
+WORDS_PER_SECOND = 2.5
+WORDS_PER_PHRASE = 10
 
 
 # ==================================================================================
@@ -102,73 +108,118 @@ def writeTranslationToSRT(transcript, sourceLangCode, targetLangCode, srtFileNam
     # Now create phrases from the translation
     # textToTranslate = unicode(translation["TranslatedText"])
     textToTranslate = translation["TranslatedText"]
-    phrases = getPhrasesFromTranslation(textToTranslate, targetLangCode.value)
+    phrases = getPhrasesFromTranslation(textToTranslate, getPhrasesFromTranscript(transcript))
     writeSRT(phrases, srtFileName)
 
 
 # ==================================================================================
 # Function: getPhrasesFromTranslation
-# Purpose: Based on the JSON translation provided by Amazon Translate, get the phrases from the translation
-#          and write it out to an SRT file.  Note that since we are using a block of translated text rather than
-#          a JSON structure with the timing for the start and end of each word as in the output of Transcribe,
-#          we will need to calculate the start and end-time for each phrase
+# Purpose: Based on the text translated by Amazon Translate, create phrases with the timing of the source phrases.
+#          The translation has no timing of its own, so its words are spread over the source phrases in
+#          proportion to their length: a source phrase holding 5% of the source characters (or syllables) gets
+#          the translated words around the same 5% of the translation, and keeps its start and end time.
 # Parameters:
-#                 translation - the JSON output from Amazon Translate
-#                 targetLangCode - the language code for the translated content (e.g. Spanich = "ES")
+#          Callers of the old signature, getPhrasesFromTranslation(translation, targetLangCode), still work:
+#          without source phrases the translation is cut in phrases of WORDS_PER_PHRASE words, timed at
+#          WORDS_PER_SECOND from the start.
+# Parameters:
+#                 translation - the translated text of the whole transcript
+#                 sourcePhrases - the phrases of the source language, as returned by getPhrasesFromTranscript
+#                 unit - weigh the text by "characters" or "syllables"
 # ==================================================================================
-def getPhrasesFromTranslation(translation, targetLangCode):
-    # Now create phrases from the translation
+def getPhrasesFromTranslation(translation, sourcePhrases, unit="characters"):
+    import numpy as np
+
+    if isinstance(sourcePhrases, str):
+        return getEstimatedPhrasesFromTranslation(translation)
+
     words = translation.split()
+    if not words or not sourcePhrases:
+        return []
 
-    # print( words ) #debug statement
+    print("==> Creating phrases from translation...")
 
-    # set up some variables for the first pass
-    phrase = newPhrase()
-    phrases = []
-    nPhrase = True
-    x = 0
-    c = 0
-    seconds = 0
+    sourceWeights = np.array([getTextWeight(getPhraseText(phrase), unit) for phrase in sourcePhrases], dtype=float)
+    wordWeights = np.array([getTextWeight(word, unit) for word in words], dtype=float)
 
-    print
-    "==> Creating phrases from translation..."
+    # Every word goes to the source phrase whose share of the source text contains the middle of the word.
+    sourceEnds = np.cumsum(sourceWeights) / sourceWeights.sum()
+    wordMiddles = (np.cumsum(wordWeights) - wordWeights / 2) / wordWeights.sum()
+    phraseIndex = np.minimum(np.searchsorted(sourceEnds, wordMiddles, side="right"), len(sourcePhrases) - 1)
 
-    for word in words:
+    # Split the words where the phrase index changes, source phrases without words are left out.
+    splits = np.flatnonzero(np.diff(phraseIndex)) + 1
+    starts = np.concatenate(([0], splits))
+    ends = np.concatenate((splits, [len(words)]))
 
-        # if it is a new phrase, then get the start_time of the first item
-        if nPhrase == True:
-            phrase["start_time"] = getTimeCode(seconds)
-            nPhrase = False
-            c += 1
+    phrases = []
+    for start, end in zip(starts, ends):
+        sourcePhrase = sourcePhrases[phraseIndex[start]]
+        phrase = newPhrase()
+        phrase["start_time"] = sourcePhrase["start_time"]
+        phrase["end_time"] = sourcePhrase["end_time"]
+        phrase["words"] = splitLines(" ".join(words[start:end]))
+        phrases.append(phrase)
 
-        # Append the word to the phrase...
-        phrase["words"].append(word)
-        x += 1
+    return phrases
 
-        # now add the phrase to the phrases, generate a new phrase, etc.
-        if x == 10:
-            # For Translations, we now need to calculate the end time for the phrase
-            psecs = getSecondsFromTranslation(getPhraseText(phrase), targetLangCode, "phraseAudio" + str(c) + ".mp3")
-            seconds += psecs
-            phrase["end_time"] = getTimeCode(seconds)
 
-            # print c, phrase
-            phrases.append(phrase)
-            phrase = newPhrase()
-            nPhrase = True
-            # seconds += .001
-            x = 0
+# ==================================================================================
+# Function: getEstimatedPhrasesFromTranslation
+# Purpose: Cut a translation in phrases of WORDS_PER_PHRASE words, timed at WORDS_PER_SECOND
+# Parameters:
+#                 translation - the translated text of the whole transcript
+# ==================================================================================
+def getEstimatedPhrasesFromTranslation(translation):
+    words = translation.split()
+    phrases = []
 
-        # This if statement is to address a defect in the SubtitleClip.   If the Subtitles end up being
-        # a different duration than the content, MoviePy will sometimes fail with unexpected errors while
-        # processing the subclip.   This is limiting it to something less than the total duration for our example
-        # however, you may need to modify or eliminate this line depending on your content.
-        if c == 30:
-            break
+    for start in range(0, len(words), WORDS_PER_PHRASE):
+        phraseWords = words[start:start + WORDS_PER_PHRASE]
+        phrase = newPhrase()
+        phrase["start_time"] = getTimeCode(start / WORDS_PER_SECOND)
+        phrase["end_time"] = getTimeCode((start + len(phraseWords)) / WORDS_PER_SECOND)
+        phrase["words"] = splitLines(" ".join(phraseWords))
+        phrases.append(phrase)
 
     return phrases
 
 
+# ==================================================================================
+# Function: getTextWeight
+# Purpose: The length of a text, in characters without spaces or in (estimated) syllables
+# Parameters:
+#                 text - the text to weigh
+#                 unit - "characters" or "syllables"
+# ==================================================================================
+def getTextWeight(text, unit="characters"):
+    if unit == "characters":
+        return max(1, len(text) - text.count(" ") - text.count("\n"))
+    if unit == "syllables":
+        # Groups of vowels, at least one per word for scripts that do not write them.
+        return sum(max(1, len(re.findall(r"[aeiouyàáâãäåèéêëìíîïòóôõöùúûüý]+", word)))
+                   for word in text.lower().split())
+
+    raise ValueError("Unknown unit: " + unit)
+
+
+# ==================================================================================
+# Function: splitLines
+# Purpose: Split a text that is too long for one line in two lines of about the same length
+# Parameters:
+#                 text - the text of a phrase
+# ==================================================================================
+def splitLines(text):
+    if len(text) <= MAX_LINE_LENGTH or " " not in text:
+        return [text]
+
+    middle = len(text) // 2
+    spaces = [i for i, char in enumerate(text) if char == " "]
+    split = min(spaces, key=lambda i: abs(i - middle))
+
+    return [text[:split], "\n", text[split + 1:]]
+
+
 # ==================================================================================
 # Function: getPhrasesFromTranscript
 # Purpose: Based on the JSON transcript provided by Amazon Transcribe, get the phrases from the translation
@@ -328,7 +379,9 @@ def distribute_line(phrase):
 
 # ==================================================================================
 # Function: translateTranscript
-# Purpose: Based on the JSON transcript provided by Amazon Transcribe, get the JSON response of translated text
+# Purpose: Based on the JSON transcript provided by Amazon Transcribe, get the JSON response of translated text.
+#          Transcripts larger than one request allows are translated in chunks of whole sentences, and the
+#          translated chunks are joined into one TranslatedText.
 # Parameters:
 #                 transcript - the JSON output from Amazon Transcribe
 #                 sourceLangCode - the language code for the original content (e.g. English = "EN")
@@ -346,14 +399,62 @@ def translateTranscript(transcript, sourceLangCode, targetLangCode, region):
     txt = ts["results"]["transcripts"][0]["transcript"]
 
     # set up the Amazon Translate client
+    import boto3
     translate = boto3.client(service_name='translate', region_name=region, use_ssl=True)
 
     # call Translate  with the text, source language code, and target language code.  The result is a JSON structure containing the
     # translated text
-    translation = translate.translate_text(Text=txt, SourceLanguageCode=sourceLangCode,
-                                           TargetLanguageCode=targetLangCode)
+    translatedChunks = []
+    for chunk in splitForTranslation(txt):
+        translation = translate.translate_text(Text=chunk, SourceLanguageCode=sourceLangCode,
+                                               TargetLanguageCode=targetLangCode)
+        translatedChunks.append(translation["TranslatedText"])
 
-    return translation
+    return {"TranslatedText": " ".join(translatedChunks)}
+
+
+# ==================================================================================
+# Function: splitForTranslation
+# Purpose: Split text into chunks of at most maxBytes UTF-8 bytes, on sentence boundaries where possible and on
+#          word boundaries for sentences that are too long by themselves. A word that is too long by itself is
+#          cut between characters, never inside the UTF-8 encoding of one.
+# Parameters:
+#                 text - the text to split
+#                 maxBytes - the largest chunk, in bytes
+# ==================================================================================
+def splitForTranslation(text, maxBytes=MAX_TRANSLATE_BYTES):
+    pieces = []
+    for sentence in re.split(r"(?<=[.!?])\s+", text.strip()):
+        if len(sentence.encode("utf-8")) <= maxBytes:
+            pieces.append(sentence)
+            continue
+
+        for word in sentence.split():
+            if len(word.encode("utf-8")) <= maxBytes:
+                pieces.append(word)
+                continue
+
+            piece = ""
+            for character in word:
+                if len((piece + character).encode("utf-8")) > maxBytes:
+                    pieces.append(piece)
+                    piece = ""
+                piece += character
+            pieces.append(piece)
+
+    chunks = []
+    chunk = ""
+    for piece in pieces:
+        candidate = chunk + " " + piece if chunk else piece
+        if chunk and len(candidate.encode("utf-8")) > maxBytes:
+            chunks.append(chunk)
+            candidate = piece
+        chunk = candidate
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks
 
 
 # ==================================================================================
@@ -364,6 +465,12 @@ def translateTranscript(transcript, sourceLangCode, targetLangCode, region):
 #                 filename - the name of the SRT output file (e.g. "mySRT.srt")
 # ==================================================================================
 def writeSRT(phrases, filename):
+    with metrics.timer('srt_write_seconds'):
+        _writeSRT(phrases, filename)
+    metrics.inc('srt_phrases_written_total', len(phrases))
+
+
+def _writeSRT(phrases, filename):
     print
     "==> Writing phrases to disk..."
 